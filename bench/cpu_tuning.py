@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import argparse
+import difflib
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+
+DEFAULT_INPUT_DIR = os.path.join(REPO_DIR, "input")
+COMPARED_FIELDS = ("merchant_name", "invoice_number", "date", "total_amount", "currency")
+
+# Compares EasyOCR CPU settings on the same inputs: float32 against dynamic
+# int8 networks, at a few intra-op thread counts. Each setting runs in a
+# fresh process because torch thread counts and the loaded networks are
+# fixed per process. The float32 run at the highest thread count is the
+# reference that the others are scored against, since the corpus has no
+# ground truth.
+
+
+def run_config(input_dir, threads, quantize):
+    from main import extract_file
+    from run_bench import _list_inputs
+    from ocr import configure_cpu, _get_reader
+    import ocr_cache
+
+    ocr_cache.configure(enabled=False)
+    configure_cpu(threads=threads, quantize=quantize)
+    start = time.perf_counter()
+    _get_reader()
+    load_seconds = time.perf_counter() - start
+
+    files = {}
+    for file_path in _list_inputs(input_dir):
+        start = time.perf_counter()
+        try:
+            result = extract_file(file_path)
+        except Exception as e:
+            print(f"Failed to process {file_path}: {e}", file=sys.stderr)
+            continue
+        parsed = result["parsed"]
+        files[os.path.basename(file_path)] = {
+            "seconds": time.perf_counter() - start,
+            "text": " ".join(str(r[1]) for r in result["ocr_results"]),
+            "fields": {field: parsed.get(field) for field in COMPARED_FIELDS},
+            "line_items": len(parsed.get("line_items") or []),
+        }
+    return {"threads": threads, "quantize": quantize, "load_seconds": load_seconds, "files": files}
+
+
+def _spawn(input_dir, threads, quantize):
+    command = [sys.executable, os.path.abspath(__file__), "--input-dir", input_dir,
+               "--run-one", str(threads)]
+    if not quantize:
+        command.append("--float32")
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def score(run, reference):
+    seconds = [f["seconds"] for f in run["files"].values()]
+    field_matches = field_total = items_matches = 0
+    similarities = []
+    for name, expected in reference["files"].items():
+        got = run["files"].get(name)
+        if got is None:
+            field_total += len(COMPARED_FIELDS)
+            similarities.append(0.0)
+            continue
+        for field in COMPARED_FIELDS:
+            field_total += 1
+            field_matches += got["fields"][field] == expected["fields"][field]
+        items_matches += got["line_items"] == expected["line_items"]
+        similarities.append(difflib.SequenceMatcher(None, got["text"], expected["text"]).ratio())
+    files = len(reference["files"]) or 1
+    return {
+        "median_s": statistics.median(seconds) if seconds else 0.0,
+        "total_s": sum(seconds),
+        "load_s": run["load_seconds"],
+        "field_agreement": field_matches / field_total if field_total else 1.0,
+        "line_items_agreement": items_matches / files,
+        "text_similarity": statistics.mean(similarities) if similarities else 1.0,
+    }
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Compare EasyOCR CPU thread and quantization settings")
+    arg_parser.add_argument("--input-dir", default=DEFAULT_INPUT_DIR)
+    arg_parser.add_argument("--threads", default=None,
+                            help="comma-separated intra-op thread counts (default: 1, half and all cores)")
+    arg_parser.add_argument("--output", help="also write the scores as JSON")
+    arg_parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    arg_parser.add_argument("--float32", action="store_true", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+
+    if args.run_one:
+        # Child process: the last stdout line carries the result.
+        print(json.dumps(run_config(args.input_dir, args.run_one, not args.float32)))
+        return 0
+
+    cores = os.cpu_count() or 1
+    if args.threads:
+        thread_counts = sorted({max(1, int(t)) for t in args.threads.split(",")})
+    else:
+        thread_counts = sorted({1, max(1, cores // 2), cores})
+
+    runs = []
+    for quantize in (False, True):
+        for threads in thread_counts:
+            label = "int8" if quantize else "float32"
+            print(f"Running {label} with {threads} thread(s)...")
+            runs.append(_spawn(args.input_dir, threads, quantize))
+
+    reference = next(r for r in runs if not r["quantize"] and r["threads"] == thread_counts[-1])
+    reference_total = score(reference, reference)["total_s"] or 1.0
+    rows = []
+    print(f"\n  {'networks':<9}{'threads':>8}{'load s':>9}{'median s':>10}{'speedup':>9}"
+          f"{'fields':>8}{'items':>7}{'text':>7}")
+    for run in runs:
+        s = score(run, reference)
+        s.update({"networks": "int8" if run["quantize"] else "float32", "threads": run["threads"],
+                  "speedup": reference_total / s["total_s"] if s["total_s"] else 0.0})
+        rows.append(s)
+        print(f"  {s['networks']:<9}{s['threads']:>8}{s['load_s']:>9.2f}{s['median_s']:>10.3f}"
+              f"{s['speedup']:>8.2f}x{s['field_agreement']:>8.1%}{s['line_items_agreement']:>7.0%}"
+              f"{s['text_similarity']:>7.1%}")
+    print(f"\nScored against float32 with {thread_counts[-1]} thread(s) on {len(reference['files'])} file(s).")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"reference": {"networks": "float32", "threads": thread_counts[-1]}, "results": rows},
+                      f, indent=4)
+        print(f"Saved {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+import os
+import sys
+import json
+import time
+import glob
+import math
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+
+DEFAULT_INPUT_DIR = os.path.join(REPO_DIR, "input")
+DEFAULT_FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+# Synthetic receipts are also grouped into lines at these rotations; a
+# grouping that merges separate printed lines fails the run.
+SKEW_CHECK_DEGREES = (0, 1.5, 3)
+# Receipts printed from one template, as the duplicate check renders them.
+DEDUP_CHECK_RECEIPTS = 5
+
+
+def _list_inputs(input_dir):
+    from main import SUPPORTED_EXTENSIONS
+    return sorted(
+        os.path.join(input_dir, f)
+        for f in os.listdir(input_dir)
+        if f.lower().endswith(SUPPORTED_EXTENSIONS)
+    )
+
+
+def record_fixtures(input_dir, fixture_dir):
+    from main import extract_file, _to_serializable
+    import ocr_cache
+
+    ocr_cache.configure(enabled=False)
+    os.makedirs(fixture_dir, exist_ok=True)
+
+    for file_path in _list_inputs(input_dir):
+        try:
+            result = extract_file(file_path)
+        except Exception as e:
+            print(f"Failed to record {file_path}: {e}")
+            continue
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        fixture = {
+            "source": os.path.basename(file_path),
+            "is_pdf": file_path.lower().endswith(".pdf"),
+            "pages": [_to_serializable(p) for p in result["page_results"]],
+        }
+        with open(os.path.join(fixture_dir, f"{name}.ocr.json"), "w") as f:
+            json.dump(fixture, f)
+        print(f"Recorded {name}")
+
+
+def _synthetic_receipt(rows, seed, skew_degrees=0):
+    rng = random.Random(seed)
+    words = ["Milk", "Bread", "Eggs", "Butter", "Coffee", "Rice", "Apples", "Cheese", "Soap", "Tea"]
+    lines = [["FRESH", "MART"], ["Invoice", "No:", f"INV-{seed:05d}"], ["Date:", "12/03/2024"],
+             ["Item", "Qty", "Price", "Total"]]
+    grand_total = 0.0
+    for _ in range(rows):
+        qty = rng.randint(1, 5)
+        price = round(rng.uniform(1, 99), 2)
+        grand_total += qty * price
+        lines.append([rng.choice(words), rng.choice(words).lower(), str(qty), f"{price:.2f}", f"{qty * price:.2f}"])
+    lines.append(["Grand", "Total", f"${grand_total:.2f}"])
+
+    results = []
+    for r, line in enumerate(lines):
+        y = 40 + r * 32 + rng.randint(-3, 3)
+        for c, text in enumerate(line):
+            x = 30 + c * 150 + rng.randint(-4, 4)
+            w, h = 12 * len(text), 22 + rng.randint(-2, 2)
+            bbox = [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]
+            results.append((bbox, text, round(rng.uniform(0.6, 1.0), 3)))
+    if skew_degrees:
+        # A slightly rotated photo: every box turned about the page origin.
+        cos, sin = math.cos(math.radians(skew_degrees)), math.sin(math.radians(skew_degrees))
+        results = [
+            ([[round(px * cos - py * sin, 1), round(px * sin + py * cos, 1)] for px, py in bbox], text, conf)
+            for bbox, text, conf in results
+        ]
+    return results
+
+
+def check_line_grouping():
+    # Timing alone cannot catch a grouping that collapses a skewed receipt
+    # into one line, so count lines too: splitting a skewed line into
+    # fragments is tolerated, grouping into fewer rows than were printed is
+    # not.
+    from ocr import _group_results_into_lines
+
+    failures = []
+    rows = 12
+    expected = rows + 5
+    for degrees in SKEW_CHECK_DEGREES:
+        results = _synthetic_receipt(rows, seed=rows, skew_degrees=degrees)
+        got = len(_group_results_into_lines(results))
+        status = "ok" if got >= expected else "FAILED"
+        print(f"  line grouping at {degrees} deg skew: {got} line(s) for {expected} printed  {status}")
+        if got < expected:
+            failures.append(f"line_grouping/skew_{degrees}")
+    return failures
+
+
+def _render_receipt(seed, total=None):
+    # A store template: fixed header, footer and length; items, amounts,
+    # invoice number and date vary with the seed.
+    import cv2
+    import numpy as np
+
+    rng = random.Random(seed)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    image = np.full((1100, 600), 255, dtype=np.uint8)
+    cv2.putText(image, "CORNER GROCERY", (120, 60), font, 1.1, 0, 2)
+    cv2.putText(image, "12 Market Street, Springfield", (90, 100), font, 0.6, 0, 1)
+    cv2.putText(image, f"Invoice No: INV-{rng.randint(1000, 9999)}", (40, 150), font, 0.6, 0, 1)
+    cv2.putText(image, f"Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024", (40, 180), font, 0.6, 0, 1)
+    cv2.putText(image, "Item            Qty     Price", (40, 230), font, 0.6, 0, 1)
+    words = ["Milk", "Bread", "Eggs", "Butter", "Cheese", "Apples", "Rice", "Tea", "Coffee", "Sugar"]
+    grand_total = 0.0
+    for i in range(8):
+        qty, price = rng.randint(1, 5), rng.randint(1000, 30000) / 100
+        grand_total += qty * price
+        y = 270 + i * 40
+        cv2.putText(image, rng.choice(words), (40, y), font, 0.6, 0, 1)
+        cv2.putText(image, str(qty), (330, y), font, 0.6, 0, 1)
+        cv2.putText(image, f"{price:.2f}", (430, y), font, 0.6, 0, 1)
+    cv2.line(image, (40, 670), (560, 670), 0, 1)
+    cv2.putText(image, f"TOTAL        {total or f'{grand_total:.2f}'}", (40, 700), font, 0.8, 0, 2)
+    cv2.putText(image, "Thank you for shopping!", (120, 1050), font, 0.6, 0, 1)
+    return image
+
+
+def check_dedup():
+    # Different receipts from one template must never share a result, even
+    # when only the total differs, while recompressed and darkened copies
+    # of a receipt should still be recognized.
+    import cv2
+    from dedup import DedupIndex
+
+    work_dir = tempfile.mkdtemp(prefix="dedup-check-")
+    failures = []
+    try:
+        def write(name, image, params=()):
+            path = os.path.join(work_dir, name)
+            cv2.imwrite(path, image, list(params))
+            return path
+
+        index = DedupIndex(os.path.join(work_dir, "index.json"))
+
+        def check(label, path, expect_match):
+            entry = index.lookup(path)
+            if entry is None:
+                index.record(path, {"source": path}, None)
+            matched = entry is not None
+            status = "ok" if matched == expect_match else "FAILED"
+            print(f"  dedup {label}: {'matched' if matched else 'kept apart'}  {status}")
+            if matched != expect_match:
+                failures.append(f"dedup/{label}")
+
+        receipts = [_render_receipt(seed, total="123.45" if seed == 0 else None)
+                    for seed in range(DEDUP_CHECK_RECEIPTS)]
+        for seed, image in enumerate(receipts):
+            check(f"template_receipt_{seed}", write(f"r{seed}.png", image), False)
+        check("same_receipt_other_total", write("total.png", _render_receipt(0, total="123.46")), False)
+        check("jpeg_copy", write("copy.jpg", receipts[0], (cv2.IMWRITE_JPEG_QUALITY, 60)), True)
+        check("darkened_copy", write("dark.png", cv2.convertScaleAbs(receipts[1], alpha=0.85)), True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return failures
+
+
+def load_fixtures(fixture_dir):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(fixture_dir, "*.ocr.json"))):
+        with open(path) as f:
+            fixture = json.load(f)
+        pages = [[(bbox, text, conf) for bbox, text, conf in page] for page in fixture["pages"]]
+        fixtures.append((os.path.basename(path)[:-len(".ocr.json")], fixture.get("is_pdf", False), pages))
+    if not fixtures:
+        print(f"No recorded fixtures in {fixture_dir}; timing synthetic receipts only (run --record first)")
+
+    # Synthetic receipts keep the micro-benchmarks meaningful before any
+    # fixtures have been recorded, and cover dense layouts the corpus lacks.
+    for rows in (20, 200, 2000):
+        fixtures.append((f"synthetic_{rows}_rows", False, [_synthetic_receipt(rows, seed=rows)]))
+    fixtures.append(("synthetic_200_rows_skewed", False, [_synthetic_receipt(200, seed=200, skew_degrees=3)]))
+    return fixtures
+
+
+def _time_call(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def run_micro(fixture_dir, repeat):
+    from ocr import _group_results_into_lines, results_to_text
+    from parser import parse_text, extract_line_items_from_ocr
+
+    metrics = {}
+    for name, is_pdf, pages in load_fixtures(fixture_dir):
+        results = [r for page in pages for r in page]
+        if is_pdf:
+            text = "".join(results_to_text(page) + "\n" for page in pages)
+        else:
+            text = results_to_text(pages[0]) if pages else ""
+
+        metrics[f"micro/{name}/group_lines"] = _time_call(
+            lambda: [_group_results_into_lines(page) for page in pages], repeat
+        )
+        metrics[f"micro/{name}/line_items_from_ocr"] = _time_call(
+            lambda: extract_line_items_from_ocr(results), repeat
+        )
+        metrics[f"micro/{name}/parse_text"] = _time_call(
+            lambda: parse_text(text, ocr_results=results), repeat
+        )
+    return metrics
+
+
+def run_e2e(input_dir, use_cache):
+    from main import extract_file
+    import instrument
+    import ocr_cache
+
+    ocr_cache.configure(enabled=use_cache)
+    files = _list_inputs(input_dir)
+    instrument.enable()
+
+    start = time.perf_counter()
+    processed = 0
+    for file_path in files:
+        try:
+            extract_file(file_path)
+            processed += 1
+        except Exception as e:
+            print(f"Failed to process {file_path}: {e}")
+    elapsed = time.perf_counter() - start
+
+    metrics = {}
+    if processed:
+        metrics["e2e/seconds_per_file"] = elapsed / processed
+    for stage_name, s in instrument.summary()["stages"].items():
+        metrics[f"e2e/{stage_name}/p50"] = s["p50_wall_s"]
+        metrics[f"e2e/{stage_name}/p95"] = s["p95_wall_s"]
+    print(f"e2e: {processed}/{len(files)} files in {elapsed:.2f}s")
+    return metrics
+
+
+def compare(metrics, baseline, threshold):
+    regressions = []
+    for name in sorted(metrics):
+        current = metrics[name]
+        previous = baseline.get(name)
+        if previous is None or previous <= 0:
+            print(f"  {name:<55} {current * 1000:10.3f} ms   (no baseline)")
+            continue
+        ratio = current / previous
+        flag = ""
+        if ratio > 1.0 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<55} {current * 1000:10.3f} ms   x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline")
+    arg_parser.add_argument("--mode", choices=["micro", "e2e", "all"], default="micro")
+    arg_parser.add_argument("--input-dir", default=DEFAULT_INPUT_DIR)
+    arg_parser.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR)
+    arg_parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    arg_parser.add_argument("--save-baseline", action="store_true",
+                            help="store this run's results as the new baseline")
+    arg_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help=f"allowed slowdown vs baseline before failing (default: {DEFAULT_THRESHOLD})")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="repetitions per micro-benchmark; the median is reported")
+    arg_parser.add_argument("--cache", action="store_true",
+                            help="let e2e runs use the OCR cache (measures parse-only iterations)")
+    arg_parser.add_argument("--record", action="store_true",
+                            help="run OCR over --input-dir and write micro-benchmark fixtures")
+    args = arg_parser.parse_args(argv)
+
+    if args.record:
+        record_fixtures(args.input_dir, args.fixture_dir)
+        return 0
+
+    metrics = {}
+    grouping_failures = []
+    if args.mode in ("micro", "all"):
+        grouping_failures = check_line_grouping() + check_dedup()
+        metrics.update(run_micro(args.fixture_dir, max(1, args.repeat)))
+    if args.mode in ("e2e", "all"):
+        metrics.update(run_e2e(args.input_dir, args.cache))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not args.save_baseline:
+        # Timings only mean something against a baseline from the same
+        # machine, so none is shipped; without one nothing can regress.
+        print(f"No baseline at {args.baseline}; nothing to compare against (run --save-baseline first)")
+
+    regressions = compare(metrics, baseline, args.threshold)
+
+    if args.save_baseline:
+        baseline.update(metrics)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f"Saved baseline {args.baseline}")
+        return 0
+
+    if grouping_failures:
+        print(f"Correctness checks failed: {', '.join(grouping_failures)}")
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}")
+    if grouping_failures or regressions:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import os
+import json
+import uuid
+import cv2
+import numpy as np
+from manifest import file_sha256, write_json_atomic
+
+INDEX_NAME = ".dedup_index.json"
+HASH_SIZE = 16
+HASH_BYTES = HASH_SIZE * HASH_SIZE // 8
+DCT_SIZE = 64
+# Out of 256 bits. The hash only picks candidates: receipts printed from the
+# same template (same header and length, different items and totals) can
+# hash closer together than a recompressed copy of one of them, so every
+# candidate is confirmed against a thumbnail before its result is reused.
+# Recompressed, darkened and noisy copies of the bundled samples stay
+# within ~40 bits; rescaled and cropped ones can drift further and are
+# then simply OCR'd again.
+DEFAULT_MAX_DISTANCE = 40
+# Matches must also have nearly the same aspect ratio, which cheaply keeps
+# apart receipts of different lengths that happen to hash close together.
+MAX_ASPECT_DIFF = 0.05
+# Grayscale thumbnails of originals, at most this wide, kept next to the
+# index for the confirming comparison.
+THUMBS_DIR = ".dedup_thumbs"
+THUMB_WIDTH = 1024
+# A candidate is confirmed when, after aligning the two thumbnails, no
+# character-sized window differs by more than this mean gray level (0-255,
+# after stretching both to full contrast). Copies of the bundled samples
+# stay below it; same-template receipts score above 100, and a single
+# changed digit scores 35-40 at ordinary print sizes. Digits printed only a
+# few pixels high at thumbnail scale can still slip through.
+MAX_WINDOW_DIFF = 25.0
+DIFF_WINDOW = 9
+# Cropping removes or adds a band of content at the edges, which says
+# nothing about the document itself.
+DIFF_MARGIN = 0.05
+
+
+def image_phash(path):
+    # A reduced grayscale decode is plenty for a 64x64 DCT and far cheaper
+    # than decoding the full color frame. The hash keeps the sign of the
+    # 16x16 lowest frequencies relative to their median; a plain difference
+    # hash flips too many bits on the near-uniform paper of a receipt.
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None or image.size == 0:
+        return None
+    h, w = image.shape[:2]
+    small = cv2.resize(image, (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only encodes overall brightness.
+    bits = low > np.median(low[1:])
+    bits[0] = False
+    return np.packbits(bits).tobytes().hex(), h / float(w)
+
+
+def image_thumbnail(path):
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None or image.size == 0:
+        return None
+    h, w = image.shape
+    if w > THUMB_WIDTH:
+        image = cv2.resize(image, (THUMB_WIDTH, max(1, round(h * THUMB_WIDTH / w))), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def _stretch(image):
+    lo, hi = np.percentile(image, (1, 99))
+    return np.clip((image.astype(np.float32) - lo) * (255.0 / max(hi - lo, 1.0)), 0, 255)
+
+
+def _align(reference, moving):
+    # Affine ECC, first on a quarter-size blur to find the rough offset and
+    # scale of a crop or rescale, then refined at full size.
+    h, w = reference.shape
+    scale = 4
+    small = [
+        cv2.GaussianBlur(cv2.resize(img, (max(1, w // scale), max(1, h // scale)), interpolation=cv2.INTER_AREA) / 255,
+                         (0, 0), 2)
+        for img in (reference, moving)
+    ]
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 100, 1e-5)
+    _, warp = cv2.findTransformECC(small[0], small[1], np.eye(2, 3, dtype=np.float32), cv2.MOTION_AFFINE,
+                                   criteria, None, 1)
+    warp[:, 2] *= scale
+    try:
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 1e-5)
+        _, warp = cv2.findTransformECC(cv2.GaussianBlur(reference / 255, (0, 0), 1.5),
+                                       cv2.GaussianBlur(moving / 255, (0, 0), 1.5), warp, cv2.MOTION_AFFINE,
+                                       criteria, None, 1)
+    except cv2.error:
+        pass
+    return cv2.warpAffine(moving, warp, (w, h), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def thumbnail_difference(a, b):
+    # Largest mean gray-level difference over any character-sized window of
+    # the two aligned thumbnails, compared at the smaller one's resolution
+    # so that upscaling blur is not counted as a difference. None when they
+    # cannot be aligned at all.
+    width = min(a.shape[1], b.shape[1])
+    height = max(1, round(a.shape[0] * width / a.shape[1]))
+    a = _stretch(cv2.resize(a, (width, height), interpolation=cv2.INTER_AREA))
+    b = _stretch(cv2.resize(b, (width, height), interpolation=cv2.INTER_AREA))
+    try:
+        b = _align(a, b)
+    except cv2.error:
+        return None
+    diff = np.abs(cv2.GaussianBlur(a, (0, 0), 1) - cv2.GaussianBlur(b, (0, 0), 1))
+    diff = cv2.boxFilter(diff, -1, (DIFF_WINDOW, DIFF_WINDOW))
+    my, mx = int(height * DIFF_MARGIN), int(width * DIFF_MARGIN)
+    diff = diff[my:height - my, mx:width - mx]
+    return float(diff.max()) if diff.size else None
+
+
+def fingerprint(file_path):
+    # Images are matched by perceptual hash; PDFs, which would need
+    # rasterizing to hash, are matched on exact content.
+    if file_path.lower().endswith(".pdf"):
+        return {"kind": "sha256", "hash": file_sha256(file_path)}
+    hashed = image_phash(file_path)
+    if hashed is None:
+        return None
+    return {"kind": "phash", "hash": hashed[0], "aspect": hashed[1]}
+
+
+class DedupIndex:
+    def __init__(self, path, max_distance=DEFAULT_MAX_DISTANCE, max_window_diff=MAX_WINDOW_DIFF):
+        self.path = path
+        self.thumbs_dir = os.path.join(os.path.dirname(path) or ".", THUMBS_DIR)
+        self.max_distance = max_distance
+        self.max_window_diff = max_window_diff
+        self.entries = []
+        self._by_source = {}
+        self._exact = {}
+        # Perceptual hashes live in one growable uint8 matrix so a lookup is
+        # a single vectorized XOR + popcount over every known image.
+        self._packed = np.zeros((64, HASH_BYTES), dtype=np.uint8)
+        self._aspects = np.zeros(64)
+        self._image_entries = []
+
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    for entry in json.load(f).get("entries", []):
+                        self._add(entry)
+            except Exception as e:
+                print(f"Ignoring unreadable dedup index {path}: {e}")
+
+    def _add(self, entry):
+        self.entries.append(entry)
+        self._by_source[entry["source"]] = entry
+        if entry["kind"] == "sha256":
+            self._exact.setdefault(entry["hash"], entry)
+            return
+        n = len(self._image_entries)
+        if n == len(self._packed):
+            self._packed = np.concatenate([self._packed, np.zeros_like(self._packed)])
+            self._aspects = np.concatenate([self._aspects, np.zeros_like(self._aspects)])
+        self._packed[n] = np.frombuffer(bytes.fromhex(entry["hash"]), dtype=np.uint8)
+        self._aspects[n] = entry["aspect"]
+        self._image_entries.append(entry)
+
+    def _candidates(self, fp):
+        # Known images within max_distance and of nearly the same shape,
+        # nearest first.
+        n = len(self._image_entries)
+        if not n:
+            return []
+        query = np.frombuffer(bytes.fromhex(fp["hash"]), dtype=np.uint8)
+        distances = np.unpackbits(np.bitwise_xor(self._packed[:n], query), axis=1).sum(axis=1)
+        aspect_ok = np.abs(self._aspects[:n] - fp["aspect"]) <= MAX_ASPECT_DIFF * fp["aspect"]
+        close = np.flatnonzero(aspect_ok & (distances <= self.max_distance))
+        return [self._image_entries[i] for i in close[np.argsort(distances[close], kind="stable")]]
+
+    def _confirmed(self, entry, thumb):
+        # Entries from an index written before thumbnails were kept cannot
+        # be confirmed, and are never reused.
+        if thumb is None or not entry.get("thumb"):
+            return False
+        stored = cv2.imread(os.path.join(self.thumbs_dir, entry["thumb"]), cv2.IMREAD_GRAYSCALE)
+        if stored is None:
+            return False
+        difference = thumbnail_difference(stored, thumb)
+        return difference is not None and difference <= self.max_window_diff
+
+    def _save_thumb(self, entry, thumb):
+        if thumb is None:
+            return
+        name = f"{uuid.uuid4().hex}.png"
+        os.makedirs(self.thumbs_dir, exist_ok=True)
+        if cv2.imwrite(os.path.join(self.thumbs_dir, name), thumb):
+            entry["thumb"] = name
+
+    def lookup(self, file_path):
+        # Returns the entry this file duplicates, or None after claiming the
+        # file as a new original. A claimed entry has no "parsed" result
+        # until record() fills it in, so later near-duplicates in the same
+        # run can wait for it instead of being OCR'd.
+        fp = fingerprint(file_path)
+        if fp is None:
+            return None
+        if fp["kind"] == "sha256":
+            match = self._exact.get(fp["hash"])
+            if match is not None and match["source"] != file_path:
+                return match
+            if match is None:
+                self._add(dict(fp, source=file_path, output=None, parsed=None, duplicates=[]))
+            return None
+
+        # The same file seen on an earlier run is not its own duplicate.
+        if any(entry["source"] == file_path for entry in self._candidates(fp)):
+            return None
+        thumb = image_thumbnail(file_path)
+        for entry in self._candidates(fp):
+            if self._confirmed(entry, thumb):
+                return entry
+        entry = dict(fp, source=file_path, output=None, parsed=None, duplicates=[])
+        self._save_thumb(entry, thumb)
+        self._add(entry)
+        return None
+
+    def record(self, file_path, parsed, output_path):
+        # Keeps the stored result of an original current when it is
+        # re-processed; files that are not originals are ignored.
+        entry = self._by_source.get(file_path)
+        if entry is not None:
+            entry["parsed"] = parsed
+            entry["output"] = output_path
+
+    def add_duplicate(self, entry, file_path):
+        if file_path not in entry["duplicates"]:
+            entry["duplicates"].append(file_path)
+
+    def clusters(self):
+        return [
+            {"original": e["source"], "output": e["output"], "duplicates": list(e["duplicates"])}
+            for e in self.entries if e["duplicates"]
+        ]
+
+    def save(self, prune=True):
+        # Originals that failed to process never got a result; drop them so
+        # they are not matched against next time, along with their
+        # thumbnails. A save part-way through a run passes prune=False, as
+        # those originals may still be matched in memory.
+        kept = [e for e in self.entries if e["parsed"] is not None]
+        write_json_atomic(self.path, {"entries": kept})
+        if prune and os.path.isdir(self.thumbs_dir):
+            referenced = {e.get("thumb") for e in kept}
+            for name in os.listdir(self.thumbs_dir):
+                if name not in referenced:
+                    os.remove(os.path.join(self.thumbs_dir, name))
@@ -0,0 +1,223 @@
+import os
+import sys
+import csv
+import math
+import json
+import time
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RECORD_FIELDS = [
+    "file", "stage", "wall_s", "cpu_s", "rss_start_mb", "rss_end_mb", "process_peak_rss_mb", "width", "height",
+]
+
+_ENABLED = False
+_RUN_START = None
+_RECORDS = []
+_LOCAL = threading.local()
+
+
+def enable():
+    global _ENABLED, _RUN_START
+    _ENABLED = True
+    _RUN_START = time.perf_counter()
+
+
+def is_enabled():
+    return _ENABLED
+
+
+def set_current_file(file_path):
+    _LOCAL.file = file_path
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_mb():
+    # Resident set size right now, which is what a stage's start and end
+    # are compared on. Only Linux exposes it cheaply; elsewhere it is None.
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * _PAGE_SIZE / (1024 * 1024), 1)
+
+
+def _peak_rss_mb():
+    # High-water mark for the whole process so far, not for one stage: it
+    # never goes down, so it only shows which stage first pushed it up.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere.
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_image(self, image):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name):
+        self.record = {
+            "file": getattr(_LOCAL, "file", None),
+            "stage": name,
+            "width": None,
+            "height": None,
+        }
+        self._discarded = False
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        # Process-wide CPU time so torch's intra-op threads are counted
+        # against the readtext stage.
+        self._cpu = time.process_time()
+        self.record["rss_start_mb"] = _rss_mb()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._discarded:
+            return False
+        self.record["wall_s"] = time.perf_counter() - self._wall
+        self.record["cpu_s"] = time.process_time() - self._cpu
+        self.record["rss_end_mb"] = _rss_mb()
+        self.record["process_peak_rss_mb"] = _peak_rss_mb()
+        _RECORDS.append(self.record)
+        return False
+
+    def discard(self):
+        self._discarded = True
+
+    def set_image(self, image):
+        try:
+            self.record["height"], self.record["width"] = image.shape[:2]
+        except Exception:
+            pass
+
+
+def stage(name):
+    if not _ENABLED:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def timed_iter(name, iterable):
+    if not _ENABLED:
+        yield from iterable
+        return
+
+    iterator = iter(iterable)
+    while True:
+        with stage(name) as st:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                st.discard()
+                return
+            st.set_image(item)
+        yield item
+
+
+def drain():
+    records = list(_RECORDS)
+    del _RECORDS[:]
+    return records
+
+
+def extend(records):
+    _RECORDS.extend(records or [])
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summary():
+    elapsed = time.perf_counter() - _RUN_START if _RUN_START is not None else 0.0
+    files = {r["file"] for r in _RECORDS if r["file"]}
+
+    by_stage = {}
+    for r in _RECORDS:
+        by_stage.setdefault(r["stage"], []).append(r)
+
+    stages = {}
+    for name, records in by_stage.items():
+        walls = sorted(r["wall_s"] for r in records)
+        rss = [r["rss_end_mb"] for r in records if r.get("rss_end_mb") is not None]
+        growth = [
+            r["rss_end_mb"] - r["rss_start_mb"]
+            for r in records
+            if r.get("rss_start_mb") is not None and r.get("rss_end_mb") is not None
+        ]
+        stages[name] = {
+            "count": len(records),
+            "total_wall_s": round(sum(walls), 4),
+            "p50_wall_s": round(_percentile(walls, 50), 4),
+            "p95_wall_s": round(_percentile(walls, 95), 4),
+            "total_cpu_s": round(sum(r["cpu_s"] for r in records), 4),
+            "max_rss_end_mb": max(rss) if rss else None,
+            "max_rss_growth_mb": round(max(growth), 1) if growth else None,
+        }
+
+    return {
+        "files": len(files),
+        "elapsed_s": round(elapsed, 3),
+        "files_per_sec": round(len(files) / elapsed, 3) if elapsed > 0 else None,
+        "stages": stages,
+    }
+
+
+def write_report(path, extra=None):
+    report_summary = summary()
+    report_summary.update(extra or {})
+    report_dir = os.path.dirname(path)
+    if report_dir:
+        os.makedirs(report_dir, exist_ok=True)
+
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+            writer.writeheader()
+            for r in _RECORDS:
+                writer.writerow({k: r.get(k) for k in RECORD_FIELDS})
+        summary_path = os.path.splitext(path)[0] + ".summary.json"
+        with open(summary_path, "w") as f:
+            json.dump(report_summary, f, indent=4)
+    else:
+        with open(path, "w") as f:
+            json.dump({"summary": report_summary, "records": _RECORDS}, f, indent=4)
+
+    return report_summary
+
+
+def print_summary(report_summary):
+    print(
+        f"Processed {report_summary['files']} file(s) in {report_summary['elapsed_s']}s"
+        f" ({report_summary['files_per_sec']} files/sec)"
+    )
+    for name, s in report_summary["stages"].items():
+        print(
+            f"  {name:<14} n={s['count']:<5} p50={s['p50_wall_s']}s"
+            f" p95={s['p95_wall_s']}s total={s['total_wall_s']}s"
+        )
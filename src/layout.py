@@ -0,0 +1,89 @@
+from itertools import chain
+import numpy as np
+
+DEFAULT_ROW_FACTOR = 0.6
+DEFAULT_MEDIAN_HEIGHT = 10.0
+
+
+class Layout:
+    def __init__(self, results):
+        self.results = results
+        self.texts = [r[1] for r in results]
+        self.confs = np.asarray([r[2] for r in results], dtype=np.float64)
+
+        self.boxes = _boxes_array(results)
+
+        mins = self.boxes.min(axis=1) if len(self.boxes) else np.zeros((0, 2), np.float32)
+        maxs = self.boxes.max(axis=1) if len(self.boxes) else np.zeros((0, 2), np.float32)
+        self.x_min, self.y_min = mins[:, 0], mins[:, 1]
+        self.x_max, self.y_max = maxs[:, 0], maxs[:, 1]
+        self.x_center = (self.x_min + self.x_max) / 2.0
+        self.y_center = (self.y_min + self.y_max) / 2.0
+        self.heights = self.y_max - self.y_min
+
+        n = len(self.heights)
+        if n:
+            # Upper median, matching sorted(heights)[n // 2], without a full sort.
+            self.median_height = float(np.partition(self.heights, n // 2)[n // 2])
+        else:
+            self.median_height = DEFAULT_MEDIAN_HEIGHT
+
+    def __len__(self):
+        return len(self.texts)
+
+    def row_gap(self, min_gap, factor=DEFAULT_ROW_FACTOR):
+        return max(min_gap, int(self.median_height * factor))
+
+    def rows(self, min_gap, factor=DEFAULT_ROW_FACTOR, mask=None):
+        if mask is None:
+            indices = np.arange(len(self.texts))
+        else:
+            indices = np.flatnonzero(mask)
+        if not len(indices):
+            return []
+
+        # Sort by vertical center and start a new row once a box is more than
+        # the gap below the current row's mean center, or the row would span
+        # more than one median height. Unlike fixed y // gap cells, a line
+        # that straddles a cell boundary stays in one row; measuring against
+        # the row rather than the previous box keeps the boxes of a skewed
+        # page from chaining into one tall row.
+        order = indices[np.argsort(self.y_center[indices], kind="stable")]
+        gap = self.row_gap(min_gap, factor)
+        span = max(gap, self.median_height)
+        row_ids = np.empty(len(order), dtype=np.int64)
+        row = count = 0
+        start = total = 0.0
+        for i, y in enumerate(self.y_center[order].tolist()):
+            if count and (y - total / count > gap or y - start > span):
+                row += 1
+                count = 0
+                total = 0.0
+            if not count:
+                start = y
+            total += y
+            count += 1
+            row_ids[i] = row
+
+        # One lexsort orders every row left to right; ties keep input order.
+        order = order[np.lexsort((order, self.x_center[order], row_ids))]
+        breaks = np.flatnonzero(np.diff(row_ids)) + 1
+        return np.split(order, breaks)
+
+
+def _boxes_array(results):
+    if not results:
+        return np.zeros((0, 4, 2), dtype=np.float32)
+    try:
+        # Flattening through fromiter is about twice as fast as np.asarray on
+        # nested point lists.
+        flat = chain.from_iterable(chain.from_iterable(r[0] for r in results))
+        return np.fromiter(flat, dtype=np.float32, count=len(results) * 8).reshape(-1, 4, 2)
+    except (ValueError, TypeError):
+        return np.asarray([r[0] for r in results], dtype=np.float32).reshape(-1, 4, 2)
+
+
+def as_layout(results):
+    if isinstance(results, Layout):
+        return results
+    return Layout(results or [])
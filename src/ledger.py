@@ -0,0 +1,184 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+
+DEFAULT_LEASE_SECONDS = 300
+# A document whose lease ran out this many times (its worker died or hung
+# each time) is marked failed rather than handed out again.
+MAX_ATTEMPTS = 3
+STATES = ("pending", "leased", "done", "failed")
+
+# The ledger is a plain SQLite file so it can sit on a filesystem shared by
+# several hosts. It stays in the default rollback-journal mode because WAL
+# needs shared memory, which network filesystems do not provide. Every
+# state change is a short BEGIN IMMEDIATE transaction, so concurrent
+# workers serialize on the file lock rather than on each other's work.
+
+
+def make_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA busy_timeout=60000")
+    return conn
+
+
+class _transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers cannot
+    # both read the same pending row and then both claim it.
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+class Ledger:
+    def __init__(self, path, owner=None, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.owner = owner or make_owner()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = _connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                path TEXT PRIMARY KEY,
+                state TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output TEXT,
+                error TEXT,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS documents_state ON documents(state, lease_expires);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._heartbeat = None
+        self._stop = threading.Event()
+
+    def _write(self, sql, params=()):
+        with _transaction(self.conn):
+            return self.conn.execute(sql, params).rowcount
+
+    def check_version(self, version):
+        # The first worker records the pipeline version; workers running a
+        # different one must not mix their outputs into the same run.
+        with _transaction(self.conn):
+            self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('pipeline_version', ?)", (version,))
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'pipeline_version'").fetchone()
+        return row[0]
+
+    def add(self, paths):
+        # Idempotent, so every worker can seed the ledger from its own view
+        # of the input folder.
+        now = time.time()
+        with _transaction(self.conn):
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO documents (path, updated_at) VALUES (?, ?)", [(p, now) for p in paths]
+            )
+            return self.conn.total_changes - before
+
+    def claim(self, limit=1):
+        now = time.time()
+        with _transaction(self.conn):
+            # Leases that expired too often belong to documents that keep
+            # killing their worker.
+            self.conn.execute(
+                "UPDATE documents SET state = 'failed', owner = NULL, error = 'lease expired', updated_at = ?"
+                " WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            rows = self.conn.execute(
+                "SELECT path FROM documents WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)"
+                " ORDER BY attempts, path LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            paths = [row[0] for row in rows]
+            self.conn.executemany(
+                "UPDATE documents SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1,"
+                " updated_at = ? WHERE path = ?",
+                [(self.owner, now + self.lease_seconds, now, p) for p in paths],
+            )
+        return paths
+
+    def renew(self, conn=None):
+        conn = conn or self.conn
+        now = time.time()
+        with _transaction(conn):
+            return conn.execute(
+                "UPDATE documents SET lease_expires = ?, updated_at = ? WHERE state = 'leased' AND owner = ?",
+                (now + self.lease_seconds, now, self.owner),
+            ).rowcount
+
+    def complete(self, path, output=None):
+        return self._write(
+            "UPDATE documents SET state = 'done', owner = NULL, lease_expires = NULL, output = ?, error = NULL,"
+            " updated_at = ? WHERE path = ?",
+            (output, time.time(), path),
+        )
+
+    def fail(self, path, error):
+        return self._write(
+            "UPDATE documents SET state = 'failed', owner = NULL, lease_expires = NULL, error = ?, updated_at = ?"
+            " WHERE path = ? AND state != 'done'",
+            (str(error), time.time(), path),
+        )
+
+    def release(self, path):
+        # Hands a claimed document back untouched, e.g. when the worker is
+        # stopped; the attempt does not count against it.
+        return self._write(
+            "UPDATE documents SET state = 'pending', owner = NULL, lease_expires = NULL,"
+            " attempts = MAX(attempts - 1, 0), updated_at = ? WHERE path = ? AND owner = ? AND state = 'leased'",
+            (time.time(), path, self.owner),
+        )
+
+    def next_expiry(self):
+        row = self.conn.execute("SELECT MIN(lease_expires) FROM documents WHERE state = 'leased'").fetchone()
+        return row[0]
+
+    def counts(self):
+        counts = dict.fromkeys(STATES, 0)
+        for state, n in self.conn.execute("SELECT state, COUNT(*) FROM documents GROUP BY state"):
+            counts[state] = n
+        return counts
+
+    def start_heartbeat(self, interval=None):
+        # Renews this worker's leases from a separate connection, so a long
+        # document keeps its lease while the main thread is busy with OCR.
+        interval = interval or max(1.0, self.lease_seconds / 3)
+
+        def beat():
+            conn = _connect(self.path)
+            try:
+                while not self._stop.wait(interval):
+                    try:
+                        self.renew(conn)
+                    except sqlite3.Error as e:
+                        print(f"Ledger heartbeat failed: {e}")
+            finally:
+                conn.close()
+
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=beat, name="ledger-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def close(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        self.conn.close()
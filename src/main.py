@@ -1,93 +1,1020 @@
 import os
 import sys
 import json
-from preprocess import preprocess_image, preprocess_image_from_array
-from ocr import extract_text, extract_text_with_boxes
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import ocr_cache
+import instrument
+import ocr_store
+import sinks
+import vendor_index
+import scheduler
+import watcher
+import ledger
+from dedup import DedupIndex, INDEX_NAME, DEFAULT_MAX_DISTANCE
+from manifest import Manifest, MANIFEST_NAME
+from preprocess import (
+    preprocess_image, preprocess_image_from_array, preprocess_text_layer, get_profile, TiledImage, PROFILES,
+    DEFAULT_PROFILE,
+)
+from ocr import (
+    extract_text, extract_text_with_boxes, extract_text_with_boxes_batch, extract_text_with_boxes_tiled,
+    results_to_text, start_warm_up, _get_reader, configure_cpu, get_cpu_config,
+)
 from parser import parse_text
-from pdf_utils import pdf_to_images
+from pdf_utils import iter_pdf_pages, TextLayerPage, DEFAULT_DPI
 
 
-def process_single_file(file_path):
-    full_text = ""
-    all_ocr_results = []
-    debug_ocr = os.environ.get("OCR_DEBUG", "").strip() == "1"
+SUPPORTED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".pdf", ".tif", ".tiff", ".bmp", ".webp")
+DEFAULT_BATCH_SIZE = 4
+# Files that may be decoded ahead of OCR, and OCR'd ahead of writing, in
+# --pipeline mode.
+DEFAULT_QUEUE_SIZE = 4
+OUTPUT_DIR = "output"
+# --cascade runs this profile first and re-runs a file with the requested
+# profile only when the cheap pass looks unreliable.
+CASCADE_FAST_PROFILE = "fast"
+CASCADE_MIN_MEAN_CONF = 0.6
+CASCADE_REQUIRED_FIELDS = ("merchant_name", "date", "total_amount")
+# Bump whenever a change to preprocessing, OCR or parsing should invalidate
+# outputs recorded by --incremental runs.
+PIPELINE_VERSION = "4"
+
+# Set by main() when --store is given; every saved result also appends its raw
+# OCR output here.
+_STORE = None
+# Where parsed results go. Defaults to one JSON file per document in
+# OUTPUT_DIR; main() swaps in the sink chosen with --sink.
+_SINK = None
+# Set by main() when --dedup is given.
+_DEDUP = None
+DUPLICATES_REPORT = "duplicates.json"
+# Per-document limits set by main() from --timeout and --memory-budget-mb;
+# files that hit them are recorded in _RETRY.
+_TIMEOUT = None
+_MEMORY_BUDGET = None
+_RETRY = None
+# How often a --ledger worker with nothing to claim checks whether another
+# worker's lease has run out.
+LEDGER_POLL_SECONDS = 5
+# Outcome counts for --cascade: "fast" plus one key per escalation reason.
+_CASCADE_STATS = {}
+
+
+def _is_pdf(file_path):
+    return file_path.lower().endswith(".pdf")
+
+
+def _iter_pages(file_path, dpi=DEFAULT_DPI, profile=DEFAULT_PROFILE, text_layer=True, tiled=False):
+    if not _is_pdf(file_path):
+        with instrument.stage("preprocess") as st:
+            processed = preprocess_image(file_path, profile=profile, tiled=tiled)
+            st.set_image(processed)
+        yield processed
+        return
+
+    pages = iter_pdf_pages(file_path, dpi=dpi, use_text_layer=text_layer)
+    for page in instrument.timed_iter("pdf_to_images", pages):
+        if isinstance(page, TextLayerPage):
+            # Born-digital page: its words come straight from the PDF and
+            # skip preprocessing and OCR entirely.
+            with instrument.stage("text_layer"):
+                yield preprocess_text_layer(page, dpi, profile=profile)
+            continue
+        with instrument.stage("preprocess") as st:
+            processed = preprocess_image_from_array(page, profile=profile, tiled=tiled)
+            st.set_image(processed)
+        yield processed
+
+
+def _ocr_page(page, preprocess_params):
+    if isinstance(page, TiledImage):
+        return extract_text_with_boxes_tiled(page.image, scale=page.scale, preprocess_params=preprocess_params)
+    return extract_text_with_boxes(page, preprocess_params=preprocess_params)
+
+
+def _ocr_pages(file_path, pages, profile=DEFAULT_PROFILE, batch_size=DEFAULT_BATCH_SIZE):
+    preprocess_params = get_profile(profile)
+    if not _is_pdf(file_path):
+        return [_ocr_page(page, preprocess_params) for page in pages]
+
+    # Pages arrive one at a time and are OCR'd in batches of batch_size,
+    # so at most one batch of preprocessed pages is held in memory. Pages
+    # read from the PDF text layer arrive as finished results and only
+    # need their slot filled.
+    page_outputs = []
+    pending = []
+
+    def flush():
+        outputs = extract_text_with_boxes_batch(
+            [page_outputs[i] for i in pending], batch_size=batch_size, preprocess_params=preprocess_params
+        )
+        for i, output in zip(pending, outputs):
+            page_outputs[i] = output
+        pending.clear()
+
+    for page in pages:
+        if isinstance(page, list):
+            page_outputs.append((results_to_text(page), page))
+            continue
+        if isinstance(page, TiledImage):
+            # Large pages are read tile by tile on their own rather than
+            # padded into a batch.
+            page_outputs.append(_ocr_page(page, preprocess_params))
+            continue
+        pending.append(len(page_outputs))
+        page_outputs.append(page)
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    return page_outputs
 
-    if file_path.lower().endswith(".pdf"):
-        pages = pdf_to_images(file_path)
-        for page in pages:
-            processed = preprocess_image_from_array(page)
-            page_text, page_results = extract_text_with_boxes(processed)
-            full_text += page_text + "\n"
-            all_ocr_results.extend(page_results)
+
+def _assemble_result(file_path, page_outputs):
+    if _is_pdf(file_path):
+        full_text = "".join(page_text + "\n" for page_text, _ in page_outputs)
     else:
-        processed = preprocess_image(file_path)
-        full_text, all_ocr_results = extract_text_with_boxes(processed)
+        full_text = page_outputs[0][0] if page_outputs else ""
+    all_ocr_results = [r for _, page_results in page_outputs for r in page_results]
+    page_result_lists = [page_results for _, page_results in page_outputs]
+
+    with instrument.stage("parse"):
+        parsed_data = parse_text(full_text, ocr_results=all_ocr_results)
+
+    return {"parsed": parsed_data, "ocr_results": all_ocr_results, "page_results": page_result_lists}
+
+
+def extract_file(file_path, dpi=DEFAULT_DPI, profile=DEFAULT_PROFILE, batch_size=DEFAULT_BATCH_SIZE,
+                 text_layer=True, cascade=False, tiled=False):
+    instrument.set_current_file(file_path)
+    if cascade and profile != CASCADE_FAST_PROFILE:
+        result = extract_file(file_path, dpi, CASCADE_FAST_PROFILE, batch_size, text_layer, tiled=tiled)
+        options = {
+            "dpi": dpi, "profile": profile, "batch_size": batch_size, "text_layer": text_layer, "tiled": tiled,
+        }
+        return _cascade_escalate(file_path, result, options)
+
+    pages = _iter_pages(file_path, dpi=dpi, profile=profile, text_layer=text_layer, tiled=tiled)
+    page_outputs = _ocr_pages(file_path, pages, profile=profile, batch_size=batch_size)
+    return _assemble_result(file_path, page_outputs)
+
+
+def _escalation_reason(result):
+    # A cheap pass is trusted when EasyOCR was confident on average and the
+    # parser found the fields that matter most; otherwise the file is
+    # re-read at full quality.
+    confs = [r[2] for r in result["ocr_results"]]
+    if not confs or sum(confs) / len(confs) < CASCADE_MIN_MEAN_CONF:
+        return "low_confidence"
+    if not all(result["parsed"].get(field) for field in CASCADE_REQUIRED_FIELDS):
+        return "missing_fields"
+    return None
+
+
+def _cascade_summary():
+    total = sum(_CASCADE_STATS.values())
+    if not total:
+        return None
+    escalated = total - _CASCADE_STATS.get("fast", 0)
+    return {
+        "files": total,
+        "escalated": escalated,
+        "escalation_rate": round(escalated / total, 4),
+        "reasons": {k: v for k, v in _CASCADE_STATS.items() if k != "fast"},
+    }
+
+
+def _to_serializable(obj):
+    try:
+        import numpy as np
+        if isinstance(obj, np.generic):
+            return obj.item()
+    except Exception:
+        pass
+    if isinstance(obj, (list, tuple)):
+        return [_to_serializable(x) for x in obj]
+    if isinstance(obj, dict):
+        return {k: _to_serializable(v) for k, v in obj.items()}
+    return obj
+
+
+def save_result(file_path, result):
+    instrument.set_current_file(file_path)
+    with instrument.stage("write"):
+        if "cascade" in result:
+            _CASCADE_STATS[result["cascade"]] = _CASCADE_STATS.get(result["cascade"], 0) + 1
+        is_duplicate = "duplicate_of" in result["parsed"]
+        if _STORE is not None and not is_duplicate:
+            _STORE.add(file_path, result["page_results"])
+        output_path = _write_result(file_path, result)
+        if _DEDUP is not None and not is_duplicate:
+            _DEDUP.record(file_path, result["parsed"], output_path)
+        return output_path
+
 
-    parsed_data = parse_text(full_text, ocr_results=all_ocr_results)
+def _save_duplicate(file_path, entry, on_saved=None):
+    print(f"Duplicate of {entry['source']}: {file_path}")
+    parsed = dict(entry["parsed"], duplicate_of=entry["source"])
+    output_path = save_result(file_path, {"parsed": parsed, "ocr_results": [], "page_results": []})
+    _DEDUP.add_duplicate(entry, file_path)
+    if on_saved:
+        on_saved(file_path, output_path)
 
-    os.makedirs("output", exist_ok=True)
-    for name in os.listdir("output"):
-        if name.lower().endswith(".json"):
-            os.remove(os.path.join("output", name))
 
-    output_name = os.path.splitext(os.path.basename(file_path))[0]
-    output_path = os.path.join("output", f"{output_name}.json")
+def _split_duplicates(files, on_saved=None):
+    # Near-duplicates of already indexed documents reuse the stored result
+    # right away. Near-duplicates of a file first seen in this run wait
+    # until that file has been processed.
+    unique = []
+    waiting = []
+    for file_path in files:
+        try:
+            entry = _DEDUP.lookup(file_path)
+        except Exception as e:
+            print(f"Could not fingerprint {file_path}: {e}")
+            entry = None
+        if entry is None:
+            unique.append(file_path)
+        elif entry["parsed"] is None:
+            waiting.append((file_path, entry))
+        else:
+            _save_duplicate(file_path, entry, on_saved)
+    return unique, waiting
 
-    with open(output_path, "w") as f:
-        json.dump(parsed_data, f, indent=4)
+
+def reparse_store(store_path):
+    # Rebuild outputs from stored OCR results alone: no images are read and
+    # no OCR model is loaded, so an archive can be re-parsed after a parser
+    # change at parsing speed.
+    count = 0
+    for source, page_results in ocr_store.iter_documents(store_path):
+        instrument.set_current_file(source)
+        try:
+            page_outputs = [(results_to_text(results), results) for results in page_results]
+            save_result(source, _assemble_result(source, page_outputs))
+            count += 1
+        except Exception as e:
+            print(f"Failed to re-parse {source}: {e}")
+    print(f"Re-parsed {count} document(s) from {store_path}")
+
+
+def _get_sink():
+    global _SINK
+    if _SINK is None:
+        _SINK = sinks.JsonSink(OUTPUT_DIR)
+    return _SINK
+
+
+def _write_result(file_path, result):
+    all_ocr_results = result["ocr_results"]
+    debug_ocr = os.environ.get("OCR_DEBUG", "").strip() == "1"
+
+    output_path = _get_sink().write(file_path, result["parsed"])
 
     if debug_ocr:
-        os.makedirs("output/_debug", exist_ok=True)
+        os.makedirs(os.path.join(OUTPUT_DIR, "_debug"), exist_ok=True)
         output_name = os.path.splitext(os.path.basename(file_path))[0]
 
-        def _to_serializable(obj):
-            try:
-                import numpy as np
-                if isinstance(obj, np.generic):
-                    return obj.item()
-            except Exception:
-                pass
-            if isinstance(obj, (list, tuple)):
-                return [_to_serializable(x) for x in obj]
-            if isinstance(obj, dict):
-                return {k: _to_serializable(v) for k, v in obj.items()}
-            return obj
-
-        with open(os.path.join("output", "_debug", f"{output_name}.ocr.json"), "w") as f:
+        with open(os.path.join(OUTPUT_DIR, "_debug", f"{output_name}.ocr.json"), "w") as f:
             json.dump(_to_serializable(all_ocr_results), f, indent=2)
 
-    print(f"Saved {output_path}")
+    return output_path
+
+
+def process_single_file(file_path, **options):
+    result = extract_file(file_path, **options)
+    return save_result(file_path, result)
+
+
+def _init_worker(cache_config, instrumented, vendor_index_path=None, cpu_config=None):
+    ocr_cache.configure(**cache_config)
+    if cpu_config:
+        configure_cpu(**cpu_config)
+    vendor_index.configure(vendor_index_path)
+    if instrumented:
+        instrument.enable()
+    # Build the EasyOCR reader once per worker process so every file the
+    # worker picks up reuses the already-loaded models. Loading runs in the
+    # background so the first file is decoded while the models come up.
+    start_warm_up()
+
+
+def _extract_with_limit(file_path, options, timeout=None):
+    if timeout:
+        # Model loading is a one-off cost of the process, not of the first
+        # document, so it happens before the clock starts.
+        _get_reader()
+    with scheduler.time_limit(timeout):
+        return extract_file(file_path, **options)
+
+
+def _record_failure(file_path, error):
+    if isinstance(error, scheduler.DocumentTimeout):
+        print(f"Timed out processing {file_path}: {error}")
+        reason = "timeout"
+    elif isinstance(error, BrokenProcessPool):
+        print(f"Worker process died while processing {file_path}")
+        reason = "crashed"
+    else:
+        print(f"Failed to process {file_path}: {error}")
+        reason = "error"
+    if _RETRY is not None:
+        _RETRY.add(file_path, reason, error)
+
+
+def _extract_in_worker(file_path, options, timeout=None):
+    result = _extract_with_limit(file_path, options, timeout)
+    # Stage timings live in the worker process; hand them back to the parent
+    # with the result so the run report covers every file.
+    result["timings"] = instrument.drain()
+    result["vendor_updates"] = vendor_index.drain_updates()
+    return result
+
+
+def _run_sequential(files, options, on_saved=None):
+    start_warm_up()
+    for file_path in files:
+        print(f"Processing: {file_path}")
+        try:
+            output_path = save_result(file_path, _extract_with_limit(file_path, options, _TIMEOUT))
+            if on_saved:
+                on_saved(file_path, output_path)
+        except (Exception, scheduler.DocumentTimeout) as e:
+            _record_failure(file_path, e)
+
+
+def _new_pool(workers):
+    cpu_config = get_cpu_config()
+    if not cpu_config["threads"]:
+        # Left to torch, every worker would start one thread per core and
+        # the workers would contend for the same cores.
+        cpu_config["threads"] = max(1, (os.cpu_count() or 1) // workers)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(ocr_cache.get_config(), instrument.is_enabled(), vendor_index.get_path(), cpu_config),
+    )
+
+
+def _run_parallel(files, workers, options, on_saved=None, memory=None):
+    # With a memory budget, files are only handed to the pool while the
+    # estimated working sets of everything in flight fit inside it; the
+    # first file that fits is taken, so one large document does not hold
+    # back the small ones behind it.
+    # A worker that dies (OOM kill, crash in native code) breaks the whole
+    # pool, failing every file in flight, not just the one that killed it.
+    # Once they have drained the pool is rebuilt and those files are rerun
+    # one at a time, so only a file that crashes on its own is recorded as
+    # failed. At most one file per worker is in flight, which bounds how
+    # many files a crash drags down with it.
+    pending = list(files)
+    in_flight = {}
+    retrying = []
+    used = 0
+    broken = False
+    pool = _new_pool(workers)
+    try:
+        while pending or retrying or in_flight:
+            if broken and not in_flight:
+                if retrying:
+                    print(f"A worker process died; retrying {len(retrying)} file(s) one at a time")
+                else:
+                    print("A worker process died; restarting the worker pool")
+                pool.shutdown(wait=True)
+                pool = _new_pool(workers)
+                broken = False
+                used = 0
+
+            try:
+                candidates = retrying[:1] if retrying else list(pending)
+                limit = 1 if retrying else workers
+                for file_path in candidates:
+                    if len(in_flight) >= limit:
+                        break
+                    need = (memory or {}).get(file_path, 0) if _MEMORY_BUDGET else 0
+                    if in_flight and used + need > (_MEMORY_BUDGET or 0):
+                        continue
+                    future = pool.submit(_extract_in_worker, file_path, options, _TIMEOUT)
+                    in_flight[future] = (file_path, need)
+                    used += need
+                    if not retrying:
+                        pending.remove(file_path)
+            except BrokenProcessPool:
+                broken = True
+                if not in_flight:
+                    continue
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path, need = in_flight.pop(future)
+                used -= need
+                isolated = file_path in retrying
+                if isolated:
+                    retrying.remove(file_path)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    broken = True
+                    if not isolated:
+                        retrying.append(file_path)
+                        continue
+                    # It ran alone in the pool, so it is the file that crashed.
+                print(f"Processing: {file_path}")
+                try:
+                    result = future.result()
+                    instrument.extend(result.pop("timings", None))
+                    vendor_index.merge(result.pop("vendor_updates", None))
+                    output_path = save_result(file_path, result)
+                    if on_saved:
+                        on_saved(file_path, output_path)
+                except (Exception, scheduler.DocumentTimeout) as e:
+                    _record_failure(file_path, e)
+    finally:
+        pool.shutdown(wait=True)
+
 
+_END_OF_PAGES = object()
+
+
+class _StageFailed(Exception):
+    pass
+
+
+def _put_unless_stopped(target_queue, item, stop):
+    # A stage blocked on a full queue would otherwise wait forever once the
+    # stage that drains it has gone, e.g. after Ctrl+C.
+    while not stop.is_set():
+        try:
+            target_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _load_pages(file_path, options, page_queue, stop):
+    instrument.set_current_file(file_path)
+    try:
+        for page in _iter_pages(file_path, dpi=options["dpi"], profile=options["profile"],
+                                text_layer=options["text_layer"], tiled=options["tiled"]):
+            if not _put_unless_stopped(page_queue, page, stop):
+                return
+    except Exception as e:
+        _put_unless_stopped(page_queue, _StageFailed(e), stop)
+    _put_unless_stopped(page_queue, _END_OF_PAGES, stop)
+
+
+def _drain_pages(page_queue, raise_errors=True):
+    while True:
+        page = page_queue.get()
+        if page is _END_OF_PAGES:
+            return
+        if isinstance(page, _StageFailed):
+            if raise_errors:
+                raise page.args[0]
+            continue
+        yield page
+
+
+def _run_staged(files, options, on_saved=None, decode_workers=None, queue_size=DEFAULT_QUEUE_SIZE):
+    # Decode/preprocess, OCR and parse/write run as separate stages joined by
+    # bounded queues. OpenCV releases the GIL, so a thread pool decodes ahead
+    # while the single OCR stage is busy, and the slowest stage sets the pace.
+    start_warm_up()
+    cascade = options["cascade"] and options["profile"] != CASCADE_FAST_PROFILE
+    # With --cascade the stages run the cheap profile; a file that needs
+    # escalating is re-read at full quality by the OCR stage itself.
+    stage_options = dict(options, profile=CASCADE_FAST_PROFILE) if cascade else options
+    file_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    decode_pool = ThreadPoolExecutor(
+        max_workers=decode_workers or min(4, os.cpu_count() or 1), thread_name_prefix="decode"
+    )
+    # Set when the OCR stage stops, normally or not, so decode tasks and the
+    # feeder give up instead of waiting on queues nobody reads any more.
+    stop = threading.Event()
+
+    def feed():
+        for file_path in files:
+            if stop.is_set():
+                return
+            page_queue = queue.Queue(maxsize=options["batch_size"] * 2)
+            decode_pool.submit(_load_pages, file_path, stage_options, page_queue, stop)
+            if not _put_unless_stopped(file_queue, (file_path, page_queue), stop):
+                return
+        _put_unless_stopped(file_queue, None, stop)
+
+    def write():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            file_path, payload, error = item
+            print(f"Processing: {file_path}")
+            try:
+                if error is not None:
+                    raise error
+                instrument.set_current_file(file_path)
+                # Cascade runs hand over finished results; otherwise parsing
+                # happens here, off the OCR stage.
+                result = payload if isinstance(payload, dict) else _assemble_result(file_path, payload)
+                output_path = save_result(file_path, result)
+                if on_saved:
+                    on_saved(file_path, output_path)
+            except (Exception, scheduler.DocumentTimeout) as e:
+                _record_failure(file_path, e)
+
+    feeder = threading.Thread(target=feed, name="feed", daemon=True)
+    writer = threading.Thread(target=write, name="write")
+    feeder.start()
+    writer.start()
+    try:
+        while True:
+            item = file_queue.get()
+            if item is None:
+                break
+            file_path, page_queue = item
+            instrument.set_current_file(file_path)
+            try:
+                page_outputs = _ocr_pages(
+                    file_path, _drain_pages(page_queue),
+                    profile=stage_options["profile"], batch_size=options["batch_size"],
+                )
+                if cascade:
+                    page_outputs = _cascade_escalate(file_path, _assemble_result(file_path, page_outputs), options)
+                write_queue.put((file_path, page_outputs, None))
+            except Exception as e:
+                # Let the decode task for this file run to completion so it
+                # does not block forever on a full page queue.
+                for _ in _drain_pages(page_queue, raise_errors=False):
+                    pass
+                write_queue.put((file_path, None, e))
+    finally:
+        stop.set()
+        feeder.join()
+        decode_pool.shutdown(wait=True, cancel_futures=True)
+        write_queue.put(None)
+        writer.join()
+
+
+def _watch(input_dir, options, poll_interval=watcher.DEFAULT_POLL_INTERVAL,
+           settle_seconds=watcher.DEFAULT_SETTLE_SECONDS):
+    # One long-running process: the reader is loaded once and stays warm, so
+    # a dropped file costs only its own OCR time.
+    start_warm_up()
+
+    def process(file_path):
+        print(f"Processing: {file_path}")
+        files = [file_path]
+        if _DEDUP is not None:
+            # An original that failed earlier leaves its duplicates waiting;
+            # in watch mode they are simply OCR'd.
+            unique, waiting = _split_duplicates(files)
+            files = unique + [path for path, _ in waiting]
+        try:
+            for path in files:
+                save_result(path, _extract_with_limit(path, options, _TIMEOUT))
+            return True
+        except (Exception, scheduler.DocumentTimeout) as e:
+            _record_failure(file_path, e)
+            return False
+        finally:
+            # Results are visible as soon as the file is moved, not when the
+            # sink's batch fills up, and what the file taught the indexes
+            # survives the daemon being killed.
+            _get_sink().flush()
+            _save_indexes(prune=False)
+
+    try:
+        watcher.watch(
+            input_dir, process, SUPPORTED_EXTENSIONS, os.path.join(OUTPUT_DIR, watcher.QUEUE_NAME),
+            poll_interval=poll_interval, settle_seconds=settle_seconds,
+        )
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
+def _run_ledger(input_dir, ledger_path, options, lease_seconds=ledger.DEFAULT_LEASE_SECONDS):
+    # Any number of these workers, on any number of hosts, can share one
+    # ledger. Paths are stored relative to the input folder so hosts that
+    # mount the archive in different places agree on them.
+    work = ledger.Ledger(ledger_path, lease_seconds=lease_seconds)
+    try:
+        version = _pipeline_version(options)
+        recorded = work.check_version(version)
+        if recorded != version:
+            print(f"Ledger {ledger_path} is for pipeline {recorded}, but this worker runs {version}")
+            return
+        added = work.add(os.path.relpath(f, input_dir) for f in _list_input_files(input_dir))
+        print(f"Ledger {ledger_path}: {added} new document(s), worker {work.owner}")
+
+        start_warm_up()
+        work.start_heartbeat()
+        while True:
+            claimed = work.claim()
+            if not claimed:
+                expiry = work.next_expiry()
+                if expiry is None:
+                    break
+                # Other workers still hold leases. Stay around in case one
+                # of them dies and its documents come back.
+                time.sleep(min(max(expiry - time.time(), 0) + 1, LEDGER_POLL_SECONDS))
+                continue
+
+            relative_path = claimed[0]
+            file_path = os.path.join(input_dir, relative_path)
+            print(f"Processing: {file_path}")
+            try:
+                output_path = save_result(file_path, _extract_with_limit(file_path, options, _TIMEOUT))
+                # A document only counts as done once its result is on disk.
+                _get_sink().flush()
+                work.complete(relative_path, output_path)
+            except (Exception, scheduler.DocumentTimeout) as e:
+                _record_failure(file_path, e)
+                work.fail(relative_path, e)
+            except BaseException:
+                work.release(relative_path)
+                raise
+    finally:
+        counts = work.counts()
+        print(f"Ledger: {counts['done']} done, {counts['failed']} failed, {counts['pending']} pending,"
+              f" {counts['leased']} leased")
+        work.close()
+
+
+def _cascade_escalate(file_path, result, options):
+    reason = _escalation_reason(result)
+    if reason is None:
+        result["cascade"] = "fast"
+        return result
+    result = extract_file(
+        file_path, dpi=options["dpi"], profile=options["profile"],
+        batch_size=options["batch_size"], text_layer=options["text_layer"], tiled=options["tiled"],
+    )
+    result["cascade"] = reason
+    return result
+
+
+def _pipeline_version(options):
+    # Outputs depend on the preprocessing profile, PDF resolution and PDF
+    # text-layer use as well as the code version, so a change to any of them
+    # forces reprocessing.
+    version = f"{PIPELINE_VERSION}/{options['profile']}/{options['dpi']}"
+    if not options["text_layer"]:
+        version += "/ocr-only"
+    if options["cascade"]:
+        version += "/cascade"
+    if options["tiled"]:
+        version += "/tiled"
+    # A file saved to one sink is not in another, so switching sinks
+    # reprocesses everything once.
+    if _get_sink().kind != sinks.DEFAULT_SINK:
+        version += f"/{_get_sink().kind}"
+    return version
+
+
+def main(input_path, workers=1, dpi=DEFAULT_DPI, profile=DEFAULT_PROFILE, batch_size=DEFAULT_BATCH_SIZE,
+         report_path=None, incremental=False, pipeline=False, text_layer=True, store_path=None,
+         reparse=False, sink=sinks.DEFAULT_SINK, sink_path=None, dedup=False,
+         dedup_distance=DEFAULT_MAX_DISTANCE, vendor_layouts=False, cascade=False, timeout=None,
+         memory_budget_mb=None, watch=False, poll_interval=watcher.DEFAULT_POLL_INTERVAL,
+         settle_seconds=watcher.DEFAULT_SETTLE_SECONDS, ledger_path=None,
+         lease_seconds=ledger.DEFAULT_LEASE_SECONDS, tiled=False):
+    global _STORE, _SINK, _DEDUP, _TIMEOUT, _MEMORY_BUDGET, _RETRY
+    options = {
+        "dpi": dpi, "profile": profile, "batch_size": batch_size, "text_layer": text_layer, "cascade": cascade,
+        "tiled": tiled,
+    }
 
-def main(input_path):
     if not os.path.exists(input_path):
         print(f"Input path not found: {input_path}")
         return
+    if watch and not os.path.isdir(input_path):
+        print(f"--watch needs a folder: {input_path}")
+        return
+    if ledger_path and not os.path.isdir(input_path):
+        print(f"--ledger needs a folder: {input_path}")
+        return
+    if pipeline and timeout:
+        # The staged pipeline runs every file through one shared OCR stage,
+        # which has no way to abandon a single document.
+        print("--timeout cannot be combined with --pipeline; use one or the other")
+        return
+
+    if report_path:
+        instrument.enable()
+    if store_path and not reparse:
+        _STORE = ocr_store.StoreWriter(store_path)
+    _SINK = sinks.open_sink(sink, output_dir=OUTPUT_DIR, path=sink_path)
+    if vendor_layouts:
+        vendor_index.configure(os.path.join(OUTPUT_DIR, vendor_index.INDEX_NAME))
+    _TIMEOUT = timeout
+    _MEMORY_BUDGET = memory_budget_mb * 1024 * 1024 if memory_budget_mb else None
+    if timeout or memory_budget_mb:
+        _RETRY = scheduler.RetryList(os.path.join(OUTPUT_DIR, scheduler.RETRY_LIST_NAME))
+    if dedup and not reparse:
+        _DEDUP = DedupIndex(os.path.join(OUTPUT_DIR, INDEX_NAME), max_distance=dedup_distance)
+    try:
+        if reparse:
+            reparse_store(input_path)
+        elif watch:
+            _watch(input_path, options, poll_interval, settle_seconds)
+        elif ledger_path:
+            _run_ledger(input_path, ledger_path, options, lease_seconds)
+        else:
+            _process_input(input_path, workers, options, incremental, pipeline)
+    finally:
+        if _STORE is not None:
+            _STORE.close()
+            _STORE = None
+        _SINK.close()
+        _SINK = None
+        _save_indexes()
+        _DEDUP = None
+        _RETRY = None
+        cascade_summary = _cascade_summary()
+        if cascade_summary:
+            print(
+                f"Cascade: {cascade_summary['escalated']} of {cascade_summary['files']} file(s) escalated"
+                f" ({cascade_summary['escalation_rate']:.1%}) {cascade_summary['reasons']}"
+            )
+        if report_path:
+            extra = {"cascade": cascade_summary} if cascade_summary else None
+            instrument.print_summary(instrument.write_report(report_path, extra=extra))
+            print(f"Saved run report {report_path}")
+
+
+def _list_input_files(input_dir):
+    return [
+        os.path.join(input_dir, f)
+        for f in os.listdir(input_dir)
+        if f.lower().endswith(SUPPORTED_EXTENSIONS)
+    ]
 
+
+def _process_input(input_path, workers, options, incremental=False, pipeline=False):
     if os.path.isdir(input_path):
-        files = [
-            os.path.join(input_path, f)
-            for f in os.listdir(input_path)
-            if f.lower().endswith((".jpg", ".jpeg", ".png", ".pdf", ".tif", ".tiff", ".bmp", ".webp"))
-        ]
+        files = _list_input_files(input_path)
 
         if not files:
             print("No valid input files found in folder.")
             return
 
-        for file_path in files:
-            print(f"Processing: {file_path}")
-            try:
-                process_single_file(file_path)
-            except Exception as e:
-                print(f"Failed to process {file_path}: {e}")
+        manifest = None
+        on_saved = None
+        if incremental:
+            version = _pipeline_version(options)
+            manifest = Manifest(os.path.join(OUTPUT_DIR, MANIFEST_NAME))
+            changed = [f for f in files if not manifest.is_unchanged(f, version)]
+            print(f"Skipping {len(files) - len(changed)} unchanged file(s)")
+            files = changed
+
+            def on_saved(file_path, output_path):
+                manifest.record(file_path, output_path, version)
+
+        waiting = []
+        if _DEDUP is not None:
+            files, waiting = _split_duplicates(files, on_saved)
+
+        memory = None
+        if workers > 1 or _TIMEOUT or _MEMORY_BUDGET:
+            planned, too_large = scheduler.plan(files, options["dpi"], options["batch_size"], _MEMORY_BUDGET)
+            for estimate in too_large:
+                needed_mb = estimate["memory"] // (1024 * 1024)
+                print(f"Skipping {estimate['path']}: needs ~{needed_mb} MB, over the memory budget")
+                if _RETRY is not None:
+                    _RETRY.add(estimate["path"], "memory_budget", f"estimated {needed_mb} MB")
+            files = [estimate["path"] for estimate in planned]
+            memory = {estimate["path"]: estimate["memory"] for estimate in planned}
+
+        try:
+            if workers > 1 and len(files) > 1:
+                _run_parallel(files, min(workers, len(files)), options, on_saved, memory)
+            elif pipeline and files:
+                _run_staged(files, options, on_saved)
+            elif files:
+                _run_sequential(files, options, on_saved)
+
+            # Originals that failed leave their duplicates to be OCR'd.
+            orphans = []
+            for file_path, entry in waiting:
+                if entry["parsed"] is None:
+                    orphans.append(file_path)
+                else:
+                    _save_duplicate(file_path, entry, on_saved)
+            if orphans:
+                _run_sequential(orphans, options, on_saved)
+        finally:
+            if manifest is not None:
+                manifest.save()
 
     else:
-        process_single_file(input_path)
+        start_warm_up()
+        process_single_file(input_path, **options)
+
+
+def _save_indexes(prune=True):
+    if _DEDUP is not None:
+        _DEDUP.save(prune=prune)
+        _write_duplicates_report(_DEDUP)
+    vendor_index.save()
+    if _RETRY is not None:
+        _RETRY.save()
+
+
+def _write_duplicates_report(index):
+    clusters = index.clusters()
+    if not clusters:
+        return
+    report_path = os.path.join(OUTPUT_DIR, DUPLICATES_REPORT)
+    with open(report_path, "w") as f:
+        json.dump({"clusters": clusters}, f, indent=2)
+    print(f"Saved duplicate report {report_path} ({len(clusters)} cluster(s))")
+
+
+def _build_arg_parser():
+    arg_parser = argparse.ArgumentParser(
+        usage="python main.py <file_or_folder_path> [options]"
+    )
+    arg_parser.add_argument("input_path")
+    arg_parser.add_argument(
+        "--workers", type=int, default=1,
+        help="number of worker processes for folder runs (default: 1)"
+    )
+    arg_parser.add_argument(
+        "--dpi", type=int, default=DEFAULT_DPI,
+        help=f"rasterization DPI for PDF pages (default: {DEFAULT_DPI})"
+    )
+    arg_parser.add_argument(
+        "--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+        help=f"preprocessing profile (default: {DEFAULT_PROFILE})"
+    )
+    arg_parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help=f"pages per OCR batch for multi-page PDFs (default: {DEFAULT_BATCH_SIZE})"
+    )
+    arg_parser.add_argument(
+        "--no-text-layer", action="store_true",
+        help="OCR every PDF page even when the PDF already contains text"
+    )
+    arg_parser.add_argument(
+        "--tiled", action="store_true",
+        help="OCR pages the profile would shrink at full resolution, in overlapping tiles"
+    )
+    arg_parser.add_argument(
+        "--tile-workers", type=int, default=1,
+        help="tiles of one page to OCR at the same time with --tiled (default: 1)"
+    )
+    arg_parser.add_argument(
+        "--dedup", action="store_true",
+        help="reuse stored results for near-duplicate inputs instead of OCR'ing them again"
+    )
+    arg_parser.add_argument(
+        "--dedup-distance", type=int, default=DEFAULT_MAX_DISTANCE,
+        help=f"max perceptual-hash distance (of 256 bits) for a duplicate candidate (default: {DEFAULT_MAX_DISTANCE})"
+    )
+    arg_parser.add_argument(
+        "--vendor-layouts", action="store_true",
+        help="learn each merchant's line-item columns and reuse them on later documents"
+    )
+    arg_parser.add_argument(
+        "--cascade", action="store_true",
+        help=f"run the '{CASCADE_FAST_PROFILE}' profile first and redo a file with --profile only"
+             " when OCR confidence is low or key fields are missing"
+    )
+    arg_parser.add_argument(
+        "--timeout", type=float, metavar="SECONDS",
+        help="per-document wall-clock limit; documents over it go to output/retry.json"
+    )
+    arg_parser.add_argument(
+        "--memory-budget-mb", type=int,
+        help="only run documents concurrently while their estimated memory fits; larger ones are skipped"
+    )
+    arg_parser.add_argument(
+        "--pipeline", action="store_true",
+        help="overlap decoding, OCR and writing of folder inputs in one process"
+    )
+    arg_parser.add_argument(
+        "--watch", action="store_true",
+        help="keep running and process files as they are dropped into the input folder,"
+             " moving each to done/ or failed/"
+    )
+    arg_parser.add_argument(
+        "--poll-interval", type=float, default=watcher.DEFAULT_POLL_INTERVAL, metavar="SECONDS",
+        help=f"how often --watch checks the folder (default: {watcher.DEFAULT_POLL_INTERVAL})"
+    )
+    arg_parser.add_argument(
+        "--settle-seconds", type=float, default=watcher.DEFAULT_SETTLE_SECONDS, metavar="SECONDS",
+        help="how long a file must stay unchanged before --watch picks it up"
+             f" (default: {watcher.DEFAULT_SETTLE_SECONDS})"
+    )
+    arg_parser.add_argument(
+        "--ledger", metavar="PATH",
+        help="claim folder inputs from a shared SQLite work ledger; run as many such workers as you like"
+    )
+    arg_parser.add_argument(
+        "--lease-seconds", type=float, default=ledger.DEFAULT_LEASE_SECONDS,
+        help="how long a --ledger claim survives without a heartbeat before another worker may take it"
+             f" (default: {ledger.DEFAULT_LEASE_SECONDS})"
+    )
+    arg_parser.add_argument(
+        "--incremental", action="store_true",
+        help="skip folder inputs whose content and pipeline version are unchanged since the last run"
+    )
+    arg_parser.add_argument(
+        "--sink", choices=sinks.SINKS, default=sinks.DEFAULT_SINK,
+        help="output format: one JSON file per document, one JSON Lines file, or a SQLite database"
+             f" (default: {sinks.DEFAULT_SINK})"
+    )
+    arg_parser.add_argument(
+        "--sink-path", metavar="PATH",
+        help="output file for the jsonl/sqlite sinks, or directory for json (default: under output/)"
+    )
+    arg_parser.add_argument(
+        "--store", metavar="DIR",
+        help="also append raw OCR results to a compact columnar store in DIR"
+    )
+    arg_parser.add_argument(
+        "--reparse-store", action="store_true",
+        help="treat the input path as an OCR store and re-parse it without reading images"
+    )
+    arg_parser.add_argument(
+        "--report", metavar="PATH",
+        help="record per-stage timings and write a run report (.json or .csv)"
+    )
+    arg_parser.add_argument(
+        "--threads", type=int,
+        help="torch intra-op threads per process (default: one per core, or cores/--workers for a pool)"
+    )
+    arg_parser.add_argument(
+        "--interop-threads", type=int,
+        help="torch inter-op threads per process (default: torch's choice)"
+    )
+    arg_parser.add_argument(
+        "--no-quantize", action="store_true",
+        help="run EasyOCR's networks in float32 instead of dynamic int8 (slower; results are cached separately)"
+    )
+    arg_parser.add_argument(
+        "--no-cache", action="store_true",
+        help="do not read or write the on-disk OCR result cache"
+    )
+    arg_parser.add_argument(
+        "--rebuild-cache", action="store_true",
+        help="ignore cached OCR results and overwrite them with fresh ones"
+    )
+    arg_parser.add_argument(
+        "--cache-dir", default=ocr_cache.DEFAULT_CACHE_DIR,
+        help=f"OCR cache location (default: {ocr_cache.DEFAULT_CACHE_DIR})"
+    )
+    arg_parser.add_argument(
+        "--cache-size-mb", type=int, default=ocr_cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+        help="OCR cache size cap; least recently used entries are evicted past it"
+    )
+    return arg_parser
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python main.py <file_or_folder_path>")
     else:
-        main(sys.argv[1])
+        args = _build_arg_parser().parse_args()
+        ocr_cache.configure(
+            enabled=not args.no_cache,
+            rebuild=args.rebuild_cache,
+            cache_dir=args.cache_dir,
+            max_bytes=args.cache_size_mb * 1024 * 1024,
+        )
+        configure_cpu(
+            threads=args.threads, interop_threads=args.interop_threads, quantize=not args.no_quantize,
+            tile_workers=args.tile_workers,
+        )
+        main(
+            args.input_path,
+            workers=max(1, args.workers),
+            dpi=args.dpi,
+            profile=args.profile,
+            batch_size=max(1, args.batch_size),
+            report_path=args.report,
+            incremental=args.incremental,
+            pipeline=args.pipeline,
+            text_layer=not args.no_text_layer,
+            store_path=args.store,
+            reparse=args.reparse_store,
+            sink=args.sink,
+            sink_path=args.sink_path,
+            dedup=args.dedup,
+            dedup_distance=args.dedup_distance,
+            vendor_layouts=args.vendor_layouts,
+            cascade=args.cascade,
+            timeout=args.timeout,
+            memory_budget_mb=args.memory_budget_mb,
+            watch=args.watch,
+            poll_interval=args.poll_interval,
+            settle_seconds=args.settle_seconds,
+            ledger_path=args.ledger,
+            lease_seconds=args.lease_seconds,
+            tiled=args.tiled,
+        )
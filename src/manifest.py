@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import tempfile
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_json_atomic(path, data, indent=None):
+    # Written to a temporary file beside the target and renamed over it, so
+    # an interrupted run leaves the previous version intact, never a
+    # truncated one.
+    target_dir = os.path.dirname(path) or "."
+    os.makedirs(target_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Manifest:
+    def __init__(self, path, flush_every=50):
+        self.path = path
+        self.flush_every = flush_every
+        self.entries = {}
+        self._unsaved = 0
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f).get("files", {})
+            except Exception as e:
+                print(f"Ignoring unreadable manifest {path}: {e}")
+
+    @staticmethod
+    def _key(file_path):
+        return os.path.abspath(file_path)
+
+    def is_unchanged(self, file_path, pipeline_version):
+        entry = self.entries.get(self._key(file_path))
+        if not entry or entry.get("pipeline_version") != pipeline_version:
+            return False
+        if not os.path.exists(entry.get("output", "")):
+            return False
+
+        st = os.stat(file_path)
+        if st.st_size == entry.get("size") and st.st_mtime == entry.get("mtime"):
+            return True
+
+        # Touched but possibly identical (copied, re-synced): fall back to
+        # the content hash before deciding to reprocess.
+        if st.st_size != entry.get("size"):
+            return False
+        if file_sha256(file_path) != entry.get("sha256"):
+            return False
+        entry["mtime"] = st.st_mtime
+        return True
+
+    def record(self, file_path, output_path, pipeline_version):
+        st = os.stat(file_path)
+        self.entries[self._key(file_path)] = {
+            "sha256": file_sha256(file_path),
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "pipeline_version": pipeline_version,
+            "output": output_path,
+        }
+        self._unsaved += 1
+        if self._unsaved >= self.flush_every:
+            self.save()
+
+    def save(self):
+        write_json_atomic(self.path, {"files": self.entries}, indent=2)
+        self._unsaved = 0
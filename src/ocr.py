@@ -1,42 +1,161 @@
-import easyocr
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import ocr_cache
+import instrument
+from layout import as_layout
 
 _READER = None
+_READER_LOCK = threading.Lock()
+_READER_SETTINGS = {"lang_list": ["en"], "gpu": False}
+# CPU inference settings, applied when the reader is built. None leaves
+# torch's defaults (one intra-op thread per core). EasyOCR already applies
+# dynamic int8 quantization to its detector and recognizer on CPU;
+# quantize=False keeps them in float32.
+# tile_workers is how many tiles of one page tiled OCR reads at once.
+_CPU_SETTINGS = {"threads": None, "interop_threads": None, "quantize": True, "tile_workers": 1}
+_EASYOCR_VERSION = None
+_WARM_UP_PENDING = False
+
+# Tiled OCR reads a large page in overlapping tiles of at most
+# TILE_SIZE x TILE_SIZE pixels, so readtext's memory is bounded by the tile
+# rather than the page. The overlap must be taller than a line of text for
+# every line to appear whole in at least one tile.
+TILE_SIZE = 1400
+TILE_OVERLAP = 200
+# A box within this many pixels of a tile edge that is not a page edge was
+# probably cut by it.
+_TILE_EDGE_MARGIN = 2
+# Boxes from different tiles are the same text when this much of the smaller
+# one lies inside the other.
+_TILE_DUPLICATE_OVERLAP = 0.5
+
+def configure_cpu(threads=None, interop_threads=None, quantize=True, tile_workers=1):
+    # Takes effect for a reader built afterwards, so call it before any OCR.
+    _CPU_SETTINGS.update({
+        "threads": threads, "interop_threads": interop_threads, "quantize": quantize,
+        "tile_workers": max(1, tile_workers or 1),
+    })
+
+def get_cpu_config():
+    return dict(_CPU_SETTINGS)
+
+def _apply_cpu_settings():
+    import torch
+    if _CPU_SETTINGS["threads"]:
+        torch.set_num_threads(_CPU_SETTINGS["threads"])
+    if _CPU_SETTINGS["interop_threads"]:
+        try:
+            torch.set_num_interop_threads(_CPU_SETTINGS["interop_threads"])
+        except RuntimeError:
+            # torch only allows this before its first parallel region.
+            pass
 
 def _get_reader():
     global _READER
     if _READER is None:
-        _READER = easyocr.Reader(['en'], gpu=False)
+        with _READER_LOCK:
+            if _READER is None:
+                # easyocr pulls in torch, which takes seconds to import, so it
+                # is only loaded once a stage actually needs the reader.
+                import easyocr
+                if not _READER_SETTINGS["gpu"]:
+                    _apply_cpu_settings()
+                _READER = easyocr.Reader(
+                    _READER_SETTINGS["lang_list"], gpu=_READER_SETTINGS["gpu"],
+                    quantize=_CPU_SETTINGS["quantize"],
+                )
     return _READER
 
+def _warm_up():
+    try:
+        _get_reader()
+    except Exception:
+        # The processing path calls _get_reader() again and reports the error.
+        pass
+
+def _start_warm_up_thread():
+    thread = threading.Thread(target=_warm_up, name="ocr-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def start_warm_up():
+    # Build the reader in the background so model loading overlaps with
+    # decoding and preprocessing of the first file. While the OCR cache can
+    # serve results the load waits for the first cache miss, so a run the
+    # cache answers in full never imports easyocr (and torch) at all.
+    global _WARM_UP_PENDING
+    if _READER is not None:
+        return None
+    if ocr_cache.is_enabled() and not ocr_cache.get_config()["rebuild"]:
+        _WARM_UP_PENDING = True
+        return None
+    return _start_warm_up_thread()
+
+def _on_cache_miss():
+    global _WARM_UP_PENDING
+    if _WARM_UP_PENDING:
+        _WARM_UP_PENDING = False
+        _start_warm_up_thread()
+
+def _easyocr_version():
+    global _EASYOCR_VERSION
+    if _EASYOCR_VERSION is None:
+        try:
+            from importlib.metadata import version
+            _EASYOCR_VERSION = version("easyocr")
+        except Exception:
+            _EASYOCR_VERSION = ""
+    return _EASYOCR_VERSION
+
+def _cache_settings(preprocess_params):
+    settings = {
+        "easyocr": _easyocr_version(),
+        "reader": repr(sorted(_READER_SETTINGS.items())),
+        "detail": 1,
+    }
+    if preprocess_params:
+        settings["preprocess"] = repr(sorted(preprocess_params.items()))
+    if not _CPU_SETTINGS["quantize"]:
+        # Float32 networks can read text differently. Quantized results keep
+        # their existing keys; thread counts do not change results.
+        settings["quantize"] = False
+    return settings
+
+def _read_results(image, preprocess_params=None):
+    key = None
+    if ocr_cache.is_enabled():
+        key = ocr_cache.make_key(image, _cache_settings(preprocess_params))
+        cached = ocr_cache.get(key)
+        if cached is not None:
+            return cached
+
+    _on_cache_miss()
+    with instrument.stage("readtext") as st:
+        st.set_image(image)
+        results = _get_reader().readtext(image, detail=1)
+
+    if key is not None:
+        ocr_cache.put(key, results)
+    return results
+
 def _group_results_into_lines(results, conf_threshold=0.0):
     if not results:
         return []
 
-    heights = []
-    for bbox, _, _ in results:
-        ys = [pt[1] for pt in bbox]
-        heights.append(max(ys) - min(ys))
-    median_height = sorted(heights)[len(heights) // 2] if heights else 10
-    bucket = max(5, int(median_height * 0.6))
-
-    lines = {}
-    for bbox, text, conf in results:
-        if conf < conf_threshold:
-            continue
-        xs = [pt[0] for pt in bbox]
-        ys = [pt[1] for pt in bbox]
-        y_center = (min(ys) + max(ys)) / 2.0
-        x_center = (min(xs) + max(xs)) / 2.0
-        y_bucket = int(y_center // bucket)
-        lines.setdefault(y_bucket, []).append((x_center, text, bbox, conf))
+    layout = as_layout(results)
+    mask = layout.confs >= conf_threshold if conf_threshold > 0 else None
 
     grouped = []
-    for y in sorted(lines.keys()):
-        grouped.append(sorted(lines[y], key=lambda item: item[0]))
+    for row in layout.rows(min_gap=5, mask=mask):
+        grouped.append([
+            (float(layout.x_center[i]), layout.texts[i], layout.results[i][0], layout.results[i][2])
+            for i in row
+        ])
     return grouped
 
 
-def extract_text_with_boxes(image, conf_threshold=0.0):
+def extract_text_with_boxes(image, conf_threshold=0.0, preprocess_params=None):
     if image is None:
         return "", []
     try:
@@ -46,22 +165,188 @@ def extract_text_with_boxes(image, conf_threshold=0.0):
         return "", []
 
     try:
-        results = _get_reader().readtext(image, detail=1)
+        results = _read_results(image, preprocess_params=preprocess_params)
     except Exception:
         return "", []
 
     if not results:
         return "", []
 
-    lines = _group_results_into_lines(results, conf_threshold=conf_threshold)
+    return results_to_text(results, conf_threshold=conf_threshold), results
+
+
+def results_to_text(results, conf_threshold=0.0):
+    with instrument.stage("group_lines"):
+        lines = _group_results_into_lines(results, conf_threshold=conf_threshold)
     text_lines = []
     for line in lines:
         text_lines.append(" ".join([w[1] for w in line]))
+    return "\n".join(text_lines)
+
+
+def _is_empty_image(image):
+    if image is None:
+        return True
+    try:
+        return image.size == 0
+    except Exception:
+        return True
+
+
+def _pad_to(image, height, width):
+    h, w = image.shape[:2]
+    if (h, w) == (height, width):
+        return image
+    # Pad bottom/right with white so box coordinates stay valid for the
+    # original image.
+    canvas = np.full((height, width) + image.shape[2:], 255, dtype=image.dtype)
+    canvas[:h, :w] = image
+    return canvas
 
-    return "\n".join(text_lines), results
 
+def _readtext_batched(images, batch_size):
+    reader = _get_reader()
+    if len(images) == 1 or len({(img.ndim, img.dtype) for img in images}) > 1:
+        return [reader.readtext(img, detail=1, batch_size=batch_size) for img in images]
 
-def extract_text(image, conf_threshold=0.0):
+    height = max(img.shape[0] for img in images)
+    width = max(img.shape[1] for img in images)
+    padded = [_pad_to(img, height, width) for img in images]
+    return reader.readtext_batched(padded, detail=1, batch_size=batch_size)
+
+
+def extract_text_with_boxes_batch(images, batch_size=4, conf_threshold=0.0, preprocess_params=None):
+    batch_size = max(1, batch_size)
+    outputs = [("", []) for _ in images]
+
+    pending = []
+    for i, image in enumerate(images):
+        if _is_empty_image(image):
+            continue
+        key = None
+        if ocr_cache.is_enabled():
+            key = ocr_cache.make_key(image, _cache_settings(preprocess_params))
+            cached = ocr_cache.get(key)
+            if cached is not None:
+                if cached:
+                    outputs[i] = (results_to_text(cached, conf_threshold=conf_threshold), cached)
+                continue
+        # Later images of the batch are still looked up in the cache while
+        # the models load.
+        _on_cache_miss()
+        pending.append((i, image, key))
+
+    # Group similarly sized images so the padding needed to stack a chunk
+    # into one detector batch stays small.
+    pending.sort(key=lambda p: p[1].shape[:2])
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        try:
+            with instrument.stage("readtext") as st:
+                st.set_image(chunk[0][1])
+                batch_results = _readtext_batched([img for _, img, _ in chunk], batch_size)
+        except Exception:
+            continue
+
+        for (i, _, key), results in zip(chunk, batch_results):
+            if key is not None:
+                ocr_cache.put(key, results)
+            if results:
+                outputs[i] = (results_to_text(results, conf_threshold=conf_threshold), results)
+
+    return outputs
+
+
+def _tile_origins(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    step = max(1, tile_size - overlap)
+    return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+
+def _merge_tile_results(tile_results, height, width):
+    # Every box is moved into page coordinates. A word in an overlap zone is
+    # read by two or more tiles; whole boxes are preferred to ones cut by a
+    # tile edge, then larger to smaller, and a box is dropped when it mostly
+    # covers one already kept from another tile.
+    candidates = []
+    for tile_index, ((y0, x0, tile_h, tile_w), results) in enumerate(tile_results):
+        for bbox, text, conf in results:
+            points = np.asarray(bbox, dtype=np.float32).reshape(4, 2)
+            (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+            cut = (
+                (x0 > 0 and x1 <= _TILE_EDGE_MARGIN)
+                or (y0 > 0 and y1 <= _TILE_EDGE_MARGIN)
+                or (x0 + tile_w < width and x2 >= tile_w - _TILE_EDGE_MARGIN)
+                or (y0 + tile_h < height and y2 >= tile_h - _TILE_EDGE_MARGIN)
+            )
+            area = float((x2 - x1) * (y2 - y1))
+            candidates.append((cut, -area, tile_index, points + (x0, y0), text, conf))
+    candidates.sort(key=lambda c: (c[0], c[1]))
+
+    kept = []
+    kept_boxes = np.zeros((len(candidates), 4), dtype=np.float32)
+    kept_tiles = np.zeros(len(candidates), dtype=np.int64)
+    for _, neg_area, tile_index, points, text, conf in candidates:
+        (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+        n = len(kept)
+        if n:
+            boxes = kept_boxes[:n]
+            iw = np.clip(np.minimum(boxes[:, 2], x2) - np.maximum(boxes[:, 0], x1), 0, None)
+            ih = np.clip(np.minimum(boxes[:, 3], y2) - np.maximum(boxes[:, 1], y1), 0, None)
+            areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            smaller = np.maximum(np.minimum(areas, -neg_area), 1e-6)
+            duplicate = (iw * ih > _TILE_DUPLICATE_OVERLAP * smaller) & (kept_tiles[:n] != tile_index)
+            if duplicate.any():
+                continue
+        kept_boxes[n] = (x1, y1, x2, y2)
+        kept_tiles[n] = tile_index
+        kept.append((points, text, conf))
+
+    # Top to bottom, left to right, like readtext on the whole page.
+    kept.sort(key=lambda r: (float(r[0][:, 1].min()), float(r[0][:, 0].min())))
+    return kept
+
+
+def extract_text_with_boxes_tiled(image, scale=1.0, conf_threshold=0.0, preprocess_params=None,
+                                  tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    # Tiles are views into the page, so nothing is resampled or copied up
+    # front; boxes are mapped back to page coordinates and multiplied by
+    # scale at the end.
+    if _is_empty_image(image):
+        return "", []
+    h, w = image.shape[:2]
+    tiles = [
+        (y, x, min(tile_size, h - y), min(tile_size, w - x))
+        for y in _tile_origins(h, tile_size, overlap)
+        for x in _tile_origins(w, tile_size, overlap)
+    ]
+
+    def read(tile):
+        y, x, tile_h, tile_w = tile
+        try:
+            return _read_results(image[y:y + tile_h, x:x + tile_w], preprocess_params=preprocess_params)
+        except Exception:
+            return []
+
+    workers = min(_CPU_SETTINGS["tile_workers"], len(tiles))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-tile") as pool:
+            tile_results = list(zip(tiles, pool.map(read, tiles)))
+    else:
+        tile_results = [(tile, read(tile)) for tile in tiles]
+
+    results = [
+        ((points * scale).tolist(), text, conf)
+        for points, text, conf in _merge_tile_results(tile_results, h, w)
+    ]
+    if not results:
+        return "", []
+    return results_to_text(results, conf_threshold=conf_threshold), results
+
+
+def extract_text(image, conf_threshold=0.0, preprocess_params=None):
     if image is None:
         return ""
     try:
@@ -71,16 +356,11 @@ def extract_text(image, conf_threshold=0.0):
         return ""
 
     try:
-        results = _get_reader().readtext(image, detail=1)
+        results = _read_results(image, preprocess_params=preprocess_params)
     except Exception:
         return ""
 
     if not results:
         return ""
 
-    lines = _group_results_into_lines(results, conf_threshold=conf_threshold)
-    final_lines = []
-    for line in lines:
-        final_lines.append(" ".join([w[1] for w in line]))
-
-    return "\n".join(final_lines)
+    return results_to_text(results, conf_threshold=conf_threshold)
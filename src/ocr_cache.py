@@ -0,0 +1,139 @@
+import os
+import hashlib
+import pickle
+import tempfile
+import numpy as np
+
+DEFAULT_CACHE_DIR = ".ocr_cache"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+_CONFIG = {
+    "enabled": False,
+    "rebuild": False,
+    "cache_dir": DEFAULT_CACHE_DIR,
+    "max_bytes": DEFAULT_MAX_BYTES,
+}
+_TOTAL_BYTES = None
+
+
+def configure(enabled=True, rebuild=False, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    global _TOTAL_BYTES
+    _CONFIG.update({
+        "enabled": enabled,
+        "rebuild": rebuild,
+        "cache_dir": cache_dir,
+        "max_bytes": max_bytes,
+    })
+    _TOTAL_BYTES = None
+
+
+def get_config():
+    return dict(_CONFIG)
+
+
+def is_enabled():
+    return _CONFIG["enabled"]
+
+
+def make_key(image, settings):
+    image = np.ascontiguousarray(image)
+    h = hashlib.sha256()
+    h.update(repr(sorted(settings.items())).encode("utf-8"))
+    h.update(repr((image.shape, str(image.dtype))).encode("utf-8"))
+    h.update(image)
+    return h.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(_CONFIG["cache_dir"], key[:2], f"{key}.pkl")
+
+
+def get(key):
+    if not _CONFIG["enabled"] or _CONFIG["rebuild"]:
+        return None
+
+    path = _entry_path(key)
+    try:
+        with open(path, "rb") as f:
+            results = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # A truncated or unreadable entry is treated as a miss and gets
+        # overwritten by the next put().
+        return None
+
+    try:
+        # Bump mtime so eviction sees this entry as recently used.
+        os.utime(path, None)
+    except OSError:
+        pass
+    return results
+
+
+def put(key, results):
+    global _TOTAL_BYTES
+    if not _CONFIG["enabled"]:
+        return
+
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    if _TOTAL_BYTES is None:
+        _TOTAL_BYTES = sum(size for _, size, _ in _list_entries())
+    else:
+        _TOTAL_BYTES += os.path.getsize(path)
+
+    if _TOTAL_BYTES > _CONFIG["max_bytes"]:
+        _evict()
+
+
+def _list_entries():
+    entries = []
+    cache_dir = _CONFIG["cache_dir"]
+    if not os.path.isdir(cache_dir):
+        return entries
+    for shard in os.listdir(cache_dir):
+        shard_dir = os.path.join(cache_dir, shard)
+        if not os.path.isdir(shard_dir):
+            continue
+        for name in os.listdir(shard_dir):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(shard_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+    return entries
+
+
+def _evict():
+    global _TOTAL_BYTES
+    entries = _list_entries()
+    total = sum(size for _, size, _ in entries)
+
+    # Drop least recently used entries until we are back under 90% of the cap,
+    # so a full cache doesn't rescan the directory on every put().
+    target = int(_CONFIG["max_bytes"] * 0.9)
+    for path, size, _ in sorted(entries, key=lambda e: e[2]):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+    _TOTAL_BYTES = total
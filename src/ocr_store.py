@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import numpy as np
+
+DEFAULT_STORE_DIR = "ocr_store"
+DEFAULT_CHUNK_DOCS = 500
+CHUNK_PREFIX = "chunk-"
+
+# Each chunk is a directory of flat arrays covering many documents:
+#   boxes.npy         float32 (R, 4, 2)  every box, in document/page order
+#   confs.npy         float32 (R,)
+#   text_offsets.npy  int64   (R + 1,)   slices into text.bin
+#   text.bin          utf-8 bytes of every box's text, back to back
+#   page_offsets.npy  int64   (P + 1,)   result range of each page
+#   doc_offsets.npy   int64   (D + 1,)   page range of each document
+#   docs.json         source path of each document
+# The arrays are memory-mapped on read, so scanning an archive does not load
+# it into memory and no per-box Python objects exist until a page is used.
+# Chunks are named by write time plus the writer's pid and a random suffix,
+# so several writers can share a store and deleting a chunk never makes a
+# later one reuse its name; sorting the names gives the order they were
+# written in.
+
+
+class StoreWriter:
+    def __init__(self, path=DEFAULT_STORE_DIR, chunk_docs=DEFAULT_CHUNK_DOCS):
+        self.path = path
+        self.chunk_docs = max(1, chunk_docs)
+        os.makedirs(path, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        self._sources = []
+        self._doc_pages = [0]
+        self._page_results = [0]
+        self._boxes = []
+        self._confs = []
+        self._texts = []
+
+    def add(self, source, page_results):
+        for results in page_results:
+            for bbox, text, conf in results:
+                self._boxes.append(bbox)
+                self._confs.append(conf)
+                self._texts.append(str(text).encode("utf-8"))
+            self._page_results.append(len(self._texts))
+        self._doc_pages.append(len(self._page_results) - 1)
+        self._sources.append(source)
+        if len(self._sources) >= self.chunk_docs:
+            self.flush()
+
+    def flush(self):
+        if not self._sources:
+            return
+
+        text_offsets = np.zeros(len(self._texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in self._texts], out=text_offsets[1:])
+        if self._boxes:
+            boxes = np.asarray(self._boxes, dtype=np.float32).reshape(-1, 4, 2)
+        else:
+            boxes = np.zeros((0, 4, 2), dtype=np.float32)
+
+        # Write into a temporary directory and rename it into place, so a
+        # reader never sees a half-written chunk.
+        tmp_dir = tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+        np.save(os.path.join(tmp_dir, "boxes.npy"), boxes)
+        np.save(os.path.join(tmp_dir, "confs.npy"), np.asarray(self._confs, dtype=np.float32))
+        np.save(os.path.join(tmp_dir, "text_offsets.npy"), text_offsets)
+        np.save(os.path.join(tmp_dir, "page_offsets.npy"), np.asarray(self._page_results, dtype=np.int64))
+        np.save(os.path.join(tmp_dir, "doc_offsets.npy"), np.asarray(self._doc_pages, dtype=np.int64))
+        with open(os.path.join(tmp_dir, "text.bin"), "wb") as f:
+            f.write(b"".join(self._texts))
+        with open(os.path.join(tmp_dir, "docs.json"), "w") as f:
+            json.dump({"sources": self._sources}, f)
+
+        os.replace(tmp_dir, os.path.join(self.path, _chunk_name()))
+        self._reset()
+
+    def close(self):
+        self.flush()
+
+
+class _Chunk:
+    def __init__(self, chunk_dir):
+        def load(name):
+            return np.load(os.path.join(chunk_dir, name), mmap_mode="r")
+
+        self.boxes = load("boxes.npy")
+        self.confs = load("confs.npy")
+        self.text_offsets = load("text_offsets.npy")
+        self.page_offsets = load("page_offsets.npy")
+        self.doc_offsets = load("doc_offsets.npy")
+        text_path = os.path.join(chunk_dir, "text.bin")
+        if os.path.getsize(text_path):
+            self.text = np.memmap(text_path, dtype=np.uint8, mode="r")
+        else:
+            self.text = np.zeros(0, dtype=np.uint8)
+        with open(os.path.join(chunk_dir, "docs.json")) as f:
+            self.sources = json.load(f)["sources"]
+
+    def page_results(self, page):
+        start, end = int(self.page_offsets[page]), int(self.page_offsets[page + 1])
+        if start == end:
+            return []
+        boxes = self.boxes[start:end].tolist()
+        confs = self.confs[start:end].tolist()
+        offsets = self.text_offsets[start:end + 1].tolist()
+        blob = self.text[offsets[0]:offsets[-1]].tobytes()
+        base = offsets[0]
+        return [
+            (boxes[i], blob[offsets[i] - base:offsets[i + 1] - base].decode("utf-8"), confs[i])
+            for i in range(end - start)
+        ]
+
+    def document(self, doc):
+        first, last = int(self.doc_offsets[doc]), int(self.doc_offsets[doc + 1])
+        return [self.page_results(page) for page in range(first, last)]
+
+
+def _chunk_name():
+    return f"{CHUNK_PREFIX}{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def _chunk_dirs(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path) if name.startswith(CHUNK_PREFIX)
+    )
+
+
+def iter_documents(path=DEFAULT_STORE_DIR):
+    # Yields (source, page_results) for every stored document, where
+    # page_results holds one list of (bbox, text, conf) per page.
+    for chunk_dir in _chunk_dirs(path):
+        chunk = _Chunk(chunk_dir)
+        for doc, source in enumerate(chunk.sources):
+            yield source, chunk.document(doc)
+
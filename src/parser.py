@@ -1,124 +1,268 @@
 import re
+import vendor_index
+from layout import as_layout
+
+# All patterns are compiled once at import; parse_text runs over millions of
+# cached OCR results, so nothing below should build a regex per call.
+
+_INVOICE_PATTERNS = [
+    re.compile(r'invoice\s*(?:no|number)?\s*[:\-]?\s*([A-Z0-9\-]+)', re.IGNORECASE),
+    re.compile(r'inv\s*[:\-]?\s*([A-Z0-9\-]+)', re.IGNORECASE),
+    re.compile(r'bill\s*no\s*[:\-]?\s*([A-Z0-9\-]+)', re.IGNORECASE),
+]
+
+_DATE_PATTERNS = [
+    re.compile(r'\d{2}[/-]\d{2}[/-]\d{4}'),
+    re.compile(r'\d{4}[/-]\d{2}[/-]\d{2}'),
+]
+
+_TOTAL_PRIORITY_PATTERNS = [
+    re.compile(r'(?:balance\s*due|amount\s*due)\s*[:\-]?\s*[₹$]?\s*(\d+\.?\d*)', re.IGNORECASE),
+    re.compile(r'grand\s*total\s*[:\-]?\s*[₹$]?\s*(\d+\.?\d*)', re.IGNORECASE),
+    re.compile(r'total\s*amount\s*[:\-]?\s*[₹$]?\s*(\d+\.?\d*)', re.IGNORECASE),
+]
+_AMOUNT_RE = re.compile(r'[₹$]?\s*(\d+\.\d{2})')
+
+_NUMBER_RE = re.compile(r'\d+(\.\d+)?')
+_DIGITS_RE = re.compile(r'\d+')
+_PRICE_RE = re.compile(r'\d+\.?\d*')
+_LOOSE_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+_TRAILING_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?\s*$')
+_MULTI_SPACE_RE = re.compile(r'\s{2,}')
+_QTY_SUFFIX_RE = re.compile(r'(\d+)\s*x')
+_QTY_PREFIX_RE = re.compile(r'x\s*(\d+)')
+_ALPHA_RE = re.compile(r'[A-Za-z]')
+_NON_LOWER_ALPHA_RE = re.compile(r'[^a-z]')
+
+_MERCHANT_IGNORE_KEYWORDS = (
+    "invoice", "bill to", "ship to",
+    "date", "invoice no", "invoice number"
+)
+_MERCHANT_MAX_LINES = 5
+
+_HEADER_KEYWORDS = (
+    "description", "qty", "quantity",
+    "price", "total", "subtotal",
+    "tax", "amount"
+)
+
+_EXCLUDED_KEYWORDS = (
+    "total", "subtotal", "tax", "vat", "gst", "amount due",
+    "balance due", "grand total", "change", "cash", "card",
+    "thank you", "paid", "payment", "tender", "invoice",
+    "date", "time", "table", "server"
+)
+_EXCLUDED_PREFIXES = ("tot", "tax", "vat", "gst", "amt", "due", "bal", "sub")
+_EXCLUDED_MISREADS = ("tex", "totd", "tota", "totl")
+
+_QTY_LABELS = ("qty", "quantity", "pcs", "pc", "ea")
+
+
+def _search_first(patterns, text):
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match
+    return None
 
 
 def extract_invoice_number(text):
-    patterns = [
-        r'invoice\s*(?:no|number)?\s*[:\-]?\s*([A-Z0-9\-]+)',
-        r'inv\s*[:\-]?\s*([A-Z0-9\-]+)',
-        r'bill\s*no\s*[:\-]?\s*([A-Z0-9\-]+)'
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match and match.groups():
-            return match.group(1)
+    match = _search_first(_INVOICE_PATTERNS, text)
+    if match and match.groups():
+        return match.group(1)
     return None
 
 
 
 def extract_date(text):
-    patterns = [
-        r'\d{2}[/-]\d{2}[/-]\d{4}',
-        r'\d{4}[/-]\d{2}[/-]\d{2}'
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            return match.group()
+    match = _search_first(_DATE_PATTERNS, text)
+    if match:
+        return match.group()
     return None
 
 
-def extract_total_amount(text):
-    priority_patterns = [
-        r'(?:balance\s*due|amount\s*due)\s*[:\-]?\s*[₹$]?\s*(\d+\.?\d*)',
-        r'grand\s*total\s*[:\-]?\s*[₹$]?\s*(\d+\.?\d*)',
-        r'total\s*amount\s*[:\-]?\s*[₹$]?\s*(\d+\.?\d*)'
-    ]
+def extract_total_amount(text, lines=None):
+    match = _search_first(_TOTAL_PRIORITY_PATTERNS, text)
+    if match and match.groups():
+        return float(match.group(1))
 
-    for pattern in priority_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match and match.groups():
-            return float(match.group(1))
-
-    amounts = re.findall(r'[₹$]?\s*(\d+\.\d{2})', text)
-    if amounts:
-        return float(amounts[-1])
+    # Only the last plain amount matters, so walk lines from the bottom and
+    # stop at the first one that has any.
+    if lines is None:
+        lines = text.split("\n")
+    for line in reversed(lines):
+        amounts = _AMOUNT_RE.findall(line)
+        if amounts:
+            return float(amounts[-1])
 
     return None
 
 def extract_currency(text):
-    text_lower = text.lower()
+    return _scan_lines(text.split("\n"))["currency"]
 
-    if "₹" in text or "rs" in text_lower or "inr" in text_lower:
-        return "INR"
-    if "$" in text or "usd" in text_lower:
-        return "USD"
 
-    return None
+def _is_merchant_line(line):
+    lower = line.lower()
+    return not any(k in lower for k in _MERCHANT_IGNORE_KEYWORDS) and len(line.split()) <= 6
 
 
 def extract_merchant_name(text):
-    lines = [l.strip() for l in text.split("\n") if l.strip()]
+    return _scan_lines(text.split("\n"))["merchant_name"]
 
-    ignore_keywords = [
-        "invoice", "bill to", "ship to",
-        "date", "invoice no", "invoice number"
-    ]
 
-    for line in lines[:5]:
-        lower = line.lower()
-        if not any(k in lower for k in ignore_keywords):
-            if len(line.split()) <= 6:
-                return line
+def _scan_lines(lines):
+    # One pass over the document's lines resolves every field that cannot
+    # span a line break. Each field stops being checked once it is settled
+    # and the loop exits as soon as all of them are.
+    merchant = None
+    merchant_checked = 0
+    date = None
+    date_fallback = None
+    has_inr = False
+    has_usd = False
 
-    return None
+    for line in lines:
+        if merchant_checked < _MERCHANT_MAX_LINES:
+            stripped = line.strip()
+            if stripped:
+                merchant_checked += 1
+                if _is_merchant_line(stripped):
+                    merchant = stripped
+                    merchant_checked = _MERCHANT_MAX_LINES
+
+        if date is None:
+            match = _DATE_PATTERNS[0].search(line)
+            if match:
+                date = match.group()
+            elif date_fallback is None:
+                match = _DATE_PATTERNS[1].search(line)
+                if match:
+                    date_fallback = match.group()
+
+        if not has_inr:
+            lower = line.lower()
+            if "₹" in line or "rs" in lower or "inr" in lower:
+                has_inr = True
+            elif not has_usd and ("$" in line or "usd" in lower):
+                has_usd = True
+
+        if merchant_checked >= _MERCHANT_MAX_LINES and date is not None and has_inr:
+            break
+
+    if has_inr:
+        currency = "INR"
+    elif has_usd:
+        currency = "USD"
+    else:
+        currency = None
+
+    return {
+        "merchant_name": merchant,
+        "date": date if date is not None else date_fallback,
+        "currency": currency,
+    }
 
 
 def _to_number_token(token):
     cleaned = token.replace(",", "").replace("$", "").replace("₹", "").replace("Rs", "").replace("rs", "")
-    if re.fullmatch(r'\d+(\.\d+)?', cleaned):
+    if _NUMBER_RE.fullmatch(cleaned):
         return float(cleaned)
     return None
 
 
-def extract_line_items_from_ocr(results):
+def _is_excluded_line(lower):
+    if any(k in lower for k in _EXCLUDED_KEYWORDS):
+        return True
+
+    letters_only = _NON_LOWER_ALPHA_RE.sub('', lower)
+    if letters_only.startswith(_EXCLUDED_PREFIXES):
+        return True
+    if letters_only in _EXCLUDED_MISREADS:
+        return True
+
+    return False
+
+
+def _header_columns(cells):
+    header_text = " ".join([c[1] for c in cells]).lower()
+    if not (all(k in header_text for k in ["item", "qty"]) and ("price" in header_text or "total" in header_text)):
+        return None
+    header_cols = {}
+    for x, t in cells:
+        t_lower = t.lower()
+        if t_lower in ("item", "items", "description"):
+            header_cols["item"] = x
+        elif t_lower in ("qty", "quantity"):
+            header_cols["qty"] = x
+        elif t_lower in ("price", "rate", "unit"):
+            header_cols["price"] = x
+        elif t_lower in ("total", "amount"):
+            header_cols["total"] = x
+    return header_cols
+
+
+def _find_header(sorted_rows, row_y, known_layout, bounds):
+    # Returns (header_cols, header_y, learned) with header_y normalized to
+    # the text block. For a known vendor the rows near its learned header
+    # position are checked first, then the rest; the learned column
+    # positions are used only when there is no header anywhere, so a
+    # header that moved is found and relearned.
+    x0, width, y0, height = bounds
+    candidates = list(range(len(sorted_rows)))
+    if known_layout is not None:
+        target = known_layout["header_y"]
+        near = [
+            i for i in candidates
+            if abs((row_y(i) - y0) / height - target) <= vendor_index.HEADER_Y_TOLERANCE
+        ]
+        candidates = near + [i for i in candidates if i not in near]
+
+    for i in candidates:
+        header_cols = _header_columns(sorted_rows[i])
+        if header_cols is not None:
+            return header_cols, (row_y(i) - y0) / height, False
+
+    if known_layout is not None:
+        header_cols = {k: x0 + v * width for k, v in known_layout["columns"].items()}
+        return header_cols, known_layout["header_y"], True
+    return {}, None, False
+
+
+def extract_line_items_from_ocr(results, known_layout=None):
+    return _line_items_from_ocr(results, known_layout)[0]
+
+
+def _line_items_from_ocr(results, known_layout=None):
+    # Returns the items plus the header found in this document, as
+    # (columns, header_y) normalized to the text block, so callers can learn
+    # the vendor's layout. The header is None when it came from
+    # known_layout or no header row was found.
     items = []
     if not results:
-        return items
-
-    heights = []
-    for bbox, _, _ in results:
-        ys = [pt[1] for pt in bbox]
-        heights.append(max(ys) - min(ys))
-    median_height = sorted(heights)[len(heights) // 2] if heights else 10
-    bucket = max(6, int(median_height * 0.6))
-
-    rows = {}
-    for bbox, text, conf in results:
-        xs = [pt[0] for pt in bbox]
-        ys = [pt[1] for pt in bbox]
-        y_center = (min(ys) + max(ys)) / 2.0
-        x_center = (min(xs) + max(xs)) / 2.0
-        y_bucket = int(y_center // bucket)
-        rows.setdefault(y_bucket, []).append((x_center, text))
+        return items, None
+
+    layout = as_layout(results)
+    x_centers = layout.x_center.tolist()
+    texts = layout.texts
+    rows = layout.rows(min_gap=6)
+    sorted_rows = [
+        [(x_centers[i], texts[i]) for i in row.tolist()]
+        for row in rows
+    ]
 
-    header_cols = {}
-    for y in sorted(rows.keys()):
-        cells = sorted(rows[y], key=lambda c: c[0])
-        header_text = " ".join([c[1] for c in cells]).lower()
-        if all(k in header_text for k in ["item", "qty"]) and ("price" in header_text or "total" in header_text):
-            for x, t in cells:
-                t_lower = t.lower()
-                if t_lower in ("item", "items", "description"):
-                    header_cols["item"] = x
-                elif t_lower in ("qty", "quantity"):
-                    header_cols["qty"] = x
-                elif t_lower in ("price", "rate", "unit"):
-                    header_cols["price"] = x
-                elif t_lower in ("total", "amount"):
-                    header_cols["total"] = x
-            break
+    x0 = float(layout.x_min.min())
+    y0 = float(layout.y_min.min())
+    width = max(float(layout.x_max.max()) - x0, 1.0)
+    height = max(float(layout.y_max.max()) - y0, 1.0)
+
+    def row_y(i):
+        return float(layout.y_center[rows[i]].mean())
+
+    header_cols, header_y, from_index = _find_header(sorted_rows, row_y, known_layout, (x0, width, y0, height))
+
+    found_header = None
+    if header_cols and not from_index:
+        found_header = ({k: (x - x0) / width for k, x in header_cols.items()}, header_y)
 
     def _closest_col(x):
         if not header_cols:
@@ -126,37 +270,14 @@ def extract_line_items_from_ocr(results):
         closest = min(header_cols.items(), key=lambda kv: abs(x - kv[1]))
         return closest[0]
 
-    def _is_excluded_line(text):
-        lower = text.lower()
-        if any(k in lower for k in [
-            "total", "subtotal", "tax", "vat", "gst", "amount due",
-            "balance due", "grand total", "change", "cash", "card",
-            "thank you", "paid", "payment", "tender", "invoice",
-            "date", "time", "table", "server"
-        ]):
-            return True
-
-        letters_only = re.sub(r'[^a-z]', '', lower)
-        if letters_only.startswith(("tot", "tax", "vat", "gst", "amt", "due", "bal", "sub")):
-            return True
-        if letters_only in ("tex", "totd", "tota", "totl"):
-            return True
-
-        return False
-
     pending_item = None
-    for y in sorted(rows.keys()):
-        cells = sorted(rows[y], key=lambda c: c[0])
+    for cells in sorted_rows:
         line_text = " ".join([c[1] for c in cells])
         if len(line_text) < 5:
             continue
 
         lower = line_text.lower()
-        if any(k in lower for k in [
-            "description", "qty", "quantity",
-            "price", "total", "subtotal",
-            "tax", "amount"
-        ]) or _is_excluded_line(line_text):
+        if any(k in lower for k in _HEADER_KEYWORDS) or _is_excluded_line(lower):
             continue
 
         if header_cols:
@@ -195,7 +316,7 @@ def extract_line_items_from_ocr(results):
             continue
 
         tokens = [c[1] for c in cells]
-        alpha_tokens = [t for t in tokens if re.search(r'[A-Za-z]', t)]
+        alpha_tokens = [t for t in tokens if _ALPHA_RE.search(t)]
         numeric_tokens = []
         for t in tokens:
             val = _to_number_token(t)
@@ -242,31 +363,28 @@ def extract_line_items_from_ocr(results):
             pending_item = " ".join(alpha_tokens).strip()
             continue
 
-    return items
+    return items, found_header
 
 
-def extract_line_items(text):
+def extract_line_items(text, lines=None):
     items = []
-    lines = text.split("\n")
+    if lines is None:
+        lines = text.split("\n")
 
     for line in lines:
         line = line.strip()
         if len(line) < 5:
             continue
 
-        if any(k in line.lower() for k in [
-            "description", "qty", "quantity",
-            "price", "total", "subtotal",
-            "tax", "amount"
-        ]):
+        if any(k in line.lower() for k in _HEADER_KEYWORDS):
             continue
-        parts = re.split(r'\s{2,}', line)
+        parts = _MULTI_SPACE_RE.split(line)
 
         if len(parts) >= 3:
             try:
                 item = parts[0]
-                qty_match = re.findall(r'\d+', parts[1])
-                price_match = re.findall(r'\d+\.?\d*', parts[-1])
+                qty_match = _DIGITS_RE.findall(parts[1])
+                price_match = _PRICE_RE.findall(parts[-1])
 
                 if not qty_match or not price_match:
                     continue
@@ -287,7 +405,7 @@ def extract_line_items(text):
         numeric_tokens = []
         for i, t in enumerate(tokens):
             cleaned = t.replace(",", "").replace("$", "").replace("₹", "")
-            if re.fullmatch(r'\d+(\.\d+)?', cleaned):
+            if _NUMBER_RE.fullmatch(cleaned):
                 value = float(cleaned)
                 numeric_tokens.append({
                     "index": i,
@@ -308,7 +426,7 @@ def extract_line_items(text):
         qty = None
         lower_tokens = [t.lower() for t in tokens]
         for i, t in enumerate(lower_tokens):
-            if t in ("qty", "quantity", "pcs", "pc", "ea"):
+            if t in _QTY_LABELS:
                 for n in numeric_tokens:
                     if n["index"] > i:
                         qty = n["value"]
@@ -317,12 +435,12 @@ def extract_line_items(text):
                     break
 
         if qty is None:
-            for t in tokens:
-                m = re.fullmatch(r'(\d+)\s*x', t.lower())
+            for t in lower_tokens:
+                m = _QTY_SUFFIX_RE.fullmatch(t)
                 if m:
                     qty = float(m.group(1))
                     break
-                m = re.fullmatch(r'x\s*(\d+)', t.lower())
+                m = _QTY_PREFIX_RE.fullmatch(t)
                 if m:
                     qty = float(m.group(1))
                     break
@@ -353,9 +471,10 @@ def extract_line_items(text):
     return items
 
 
-def extract_line_items_loose(text):
+def extract_line_items_loose(text, lines=None):
     items = []
-    lines = text.split("\n")
+    if lines is None:
+        lines = text.split("\n")
 
     for line in lines:
         line = line.strip()
@@ -363,17 +482,13 @@ def extract_line_items_loose(text):
             continue
 
         lower = line.lower()
-        if any(k in lower for k in [
-            "description", "qty", "quantity",
-            "price", "total", "subtotal",
-            "tax", "amount"
-        ]):
+        if any(k in lower for k in _HEADER_KEYWORDS):
             continue
 
-        if not re.search(r'[a-zA-Z]', line):
+        if not _ALPHA_RE.search(line):
             continue
 
-        numbers = re.findall(r'\d+(?:\.\d+)?', line.replace(",", ""))
+        numbers = _LOOSE_NUMBER_RE.findall(line.replace(",", ""))
         if not numbers:
             continue
 
@@ -385,7 +500,7 @@ def extract_line_items_loose(text):
             except Exception:
                 qty = 1
 
-        item = re.sub(r'\d+(?:\.\d+)?\s*$', '', line).strip(" -|:")
+        item = _TRAILING_NUMBER_RE.sub('', line).strip(" -|:")
         if not item:
             item = line
 
@@ -403,17 +518,32 @@ def parse_text(text, ocr_results=None):
     text = text.replace("BALANCE DUE", "Balance Due")
     text = text.replace("AMOUNT DUE", "Amount Due")
 
-    line_items = extract_line_items_from_ocr(ocr_results) if ocr_results else extract_line_items(text)
+    # Tokenize once; every line-based extractor below shares this list.
+    lines = text.split("\n")
+
+    fields = _scan_lines(lines)
+
+    if ocr_results:
+        # A vendor seen before has its table columns on file, so its header
+        # is only looked for where it was last time, and a missing or
+        # misread header no longer drops the document into the text-only
+        # fallbacks below.
+        known_layout = vendor_index.lookup(fields["merchant_name"])
+        line_items, found_header = _line_items_from_ocr(ocr_results, known_layout)
+        if line_items and found_header is not None:
+            vendor_index.learn(fields["merchant_name"], *found_header)
+    else:
+        line_items = extract_line_items(text, lines)
     if not line_items:
-        line_items = extract_line_items(text)
+        line_items = extract_line_items(text, lines)
     if not line_items:
-        line_items = extract_line_items_loose(text)
+        line_items = extract_line_items_loose(text, lines)
 
     return {
-        "merchant_name": extract_merchant_name(text),
+        "merchant_name": fields["merchant_name"],
         "invoice_number": extract_invoice_number(text),
-        "date": extract_date(text),
-        "total_amount": extract_total_amount(text),
-        "currency": extract_currency(text),
+        "date": fields["date"],
+        "total_amount": extract_total_amount(text, lines),
+        "currency": fields["currency"],
         "line_items": line_items
     }
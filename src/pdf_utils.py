@@ -1,23 +1,152 @@
 import os
-from pdf2image import convert_from_path
+import re
+import html
+import subprocess
 import cv2
 import numpy as np
-import tempfile
 
-def pdf_to_images(pdf_path):
+DEFAULT_DPI = 200
+# A page needs at least this many words, most of them containing letters or
+# digits, before its text layer is trusted over OCR. Scans with no layer and
+# PDFs whose fonts extract as garbage both fall back to rasterizing.
+MIN_TEXT_LAYER_WORDS = 5
+MIN_TEXT_LAYER_READABLE = 0.6
+# pdftotext reports single words, while EasyOCR returns whole phrases and
+# the parser reads columns from box positions. Neighbouring words on the
+# same baseline are joined when the gap between them is under this many
+# average character widths, which keeps word spaces but not column gaps.
+WORD_MERGE_GAP_CHARS = 1.0
+# Baselines further apart than this fraction of the word height are on
+# different lines.
+WORD_MERGE_BASELINE_TOLERANCE = 0.25
+
+_PAGE_RE = re.compile(r'<page width="([\d.]+)" height="([\d.]+)">(.*?)</page>', re.S)
+_WORD_RE = re.compile(
+    r'<word xMin="([\d.-]+)" yMin="([\d.-]+)" xMax="([\d.-]+)" yMax="([\d.-]+)">(.*?)</word>', re.S
+)
+
+
+class TextLayerPage:
+    def __init__(self, width, height, words):
+        # Page size and word boxes are in PDF points (1/72 inch).
+        self.width = width
+        self.height = height
+        self.words = words
+
+    def is_usable(self):
+        if len(self.words) < MIN_TEXT_LAYER_WORDS:
+            return False
+        readable = sum(1 for *_, text in self.words if any(ch.isalnum() for ch in text))
+        return readable / len(self.words) >= MIN_TEXT_LAYER_READABLE
+
+    def phrases(self):
+        # Joins runs of adjacent words, in pdftotext's reading order, into
+        # phrase boxes like the ones EasyOCR produces.
+        phrases = []
+        for x0, y0, x1, y1, text in self.words:
+            if phrases:
+                px0, py0, px1, py1, ptext = phrases[-1]
+                char_width = (px1 - px0) / max(len(ptext), 1)
+                height = min(py1 - py0, y1 - y0)
+                gap = x0 - px1
+                if (abs(y1 - py1) <= height * WORD_MERGE_BASELINE_TOLERANCE
+                        and -char_width <= gap < char_width * WORD_MERGE_GAP_CHARS):
+                    phrases[-1] = (px0, min(py0, y0), x1, max(py1, y1), f"{ptext} {text}")
+                    continue
+            phrases.append((x0, y0, x1, y1, text))
+        return phrases
+
+    def to_ocr_results(self, scale):
+        # Same (bbox, text, conf) shape EasyOCR returns, scaled from points
+        # into the pixel space the OCR path would have used for this page.
+        results = []
+        for x0, y0, x1, y1, text in self.phrases():
+            x0, y0, x1, y1 = x0 * scale, y0 * scale, x1 * scale, y1 * scale
+            results.append(([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text, 1.0))
+        return results
+
+
+def pdf_page_count(pdf_path):
+    from pdf2image import pdfinfo_from_path
+    info = pdfinfo_from_path(pdf_path)
+    return int(info.get("Pages", 0))
+
+
+def pdf_text_layer(pdf_path):
+    # pdftotext ships with the poppler tools pdf2image already needs. It
+    # returns every word with its box in a few milliseconds per page.
+    try:
+        completed = subprocess.run(
+            ["pdftotext", "-bbox", "-enc", "UTF-8", pdf_path, "-"],
+            capture_output=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    pages = []
+    for width, height, body in _PAGE_RE.findall(completed.stdout.decode("utf-8", "replace")):
+        words = [
+            (float(x0), float(y0), float(x1), float(y1), html.unescape(text).strip())
+            for x0, y0, x1, y1, text in _WORD_RE.findall(body)
+        ]
+        pages.append(TextLayerPage(float(width), float(height), [w for w in words if w[4]]))
+    return pages
+
+
+def ocr_page_count(pdf_path, layer):
+    # How many pages iter_pdf_pages would rasterize for OCR, given the text
+    # layer it will be passed; nothing is rendered to find out.
+    if not layer or not any(page.is_usable() for page in layer):
+        return pdf_page_count(pdf_path)
+    return sum(1 for page in layer if not page.is_usable())
+
+
+def iter_pdf_pages(pdf_path, dpi=DEFAULT_DPI, use_text_layer=True, layer=None):
+    # Yields a TextLayerPage for born-digital pages and a BGR array for the
+    # rest, rasterizing only the pages that actually need OCR. A text layer
+    # the caller already read can be passed in to avoid reading it twice.
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"PDF not found: {pdf_path}")
+
+    if use_text_layer and layer is None:
+        layer = pdf_text_layer(pdf_path)
+    elif not use_text_layer:
+        layer = None
+    if not layer or not any(page.is_usable() for page in layer):
+        return _iter_pages(pdf_path, dpi, 1)
+    return _iter_mixed_pages(pdf_path, dpi, layer)
+
+
+def _iter_mixed_pages(pdf_path, dpi, layer):
+    for page_number, page in enumerate(layer, start=1):
+        if page.is_usable():
+            yield page
+        else:
+            yield from _iter_pages(pdf_path, dpi, 1, first=page_number, last=page_number)
+
+
+def pdf_to_images(pdf_path, dpi=DEFAULT_DPI, pages_per_chunk=1):
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"PDF not found: {pdf_path}")
 
-    images = convert_from_path(pdf_path)
+    return _iter_pages(pdf_path, dpi, max(1, pages_per_chunk))
 
-    image_paths = []
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        for i, page in enumerate(images):
-            image_path = os.path.join(temp_dir, f"page_{i}.png")
-            page.save(image_path, "PNG")
+def _iter_pages(pdf_path, dpi, pages_per_chunk, first=1, last=None):
+    from pdf2image import convert_from_path
 
-            img = cv2.imread(image_path)
-            image_paths.append(img)
+    page_count = pdf_page_count(pdf_path) if last is None else last
 
-    return image_paths
+    # Rasterize a small window of pages at a time so memory stays flat
+    # regardless of document length. pdftoppm streams PPM data straight
+    # into memory, so there is no temp-file round trip.
+    for first_page in range(first, page_count + 1, pages_per_chunk):
+        last_page = min(first_page + pages_per_chunk - 1, page_count)
+        pages = convert_from_path(
+            pdf_path, dpi=dpi, first_page=first_page, last_page=last_page
+        )
+        while pages:
+            page = pages.pop(0)
+            rgb = np.asarray(page.convert("RGB"))
+            page.close()
+            yield cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
@@ -1,7 +1,63 @@
 import cv2
+import io
 import os
 import numpy as np
 
+PROFILES = {
+    # Matches the original tuning: effective 1.5x upscale of small inputs,
+    # everything capped at 1400px, 5px blur and a 2x2 closing pass.
+    "quality": {
+        "max_dim": 1400,
+        "upscale": 1.5,
+        "blur_ksize": 5,
+        "block_size": 31,
+        "c": 2,
+        "close_kernel": 2,
+    },
+    # Smaller working resolution and lighter cleanup for clean/digital inputs.
+    "fast": {
+        "max_dim": 1000,
+        "upscale": 1.0,
+        "blur_ksize": 3,
+        "block_size": 25,
+        "c": 2,
+        "close_kernel": 0,
+    },
+}
+DEFAULT_PROFILE = "quality"
+
+# Files at least this large are memory-mapped and decoded in place instead
+# of being read into a separate buffer first.
+MMAP_MIN_BYTES = 256 * 1024
+# JPEG decoders can produce 1/2, 1/4 or 1/8 scale output directly from the
+# DCT coefficients, far cheaper than a full decode followed by a resize.
+# Other formats would decode in full and resize anyway, so they only get
+# the grayscale decode.
+_REDUCED_GRAYSCALE = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+_KERNELS = {}
+
+
+def get_profile(profile=DEFAULT_PROFILE):
+    if isinstance(profile, dict):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown preprocessing profile: {profile}")
+    return PROFILES[profile]
+
+
+def _get_kernel(size):
+    kernel = _KERNELS.get(size)
+    if kernel is None:
+        kernel = np.ones((size, size), np.uint8)
+        _KERNELS[size] = kernel
+    return kernel
+
+
 def make_ocr_safe(image):
     if len(image.shape) == 2:
         image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
@@ -21,53 +77,139 @@ def resize_safe(image, max_dim=1400):
     return image
 
 
-def preprocess_image(image_path):
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Image not found: {image_path}")
+def target_scale(height, width, max_dim, upscale=1.0):
+    # Equivalent to "shrink to max_dim, upscale, shrink to max_dim again"
+    # but computed up front so the image is resampled only once.
+    return min(upscale, max_dim / max(height, width))
 
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError("Could not read image")
 
-    image = resize_safe(image, max_dim=1400)
-    image = cv2.resize(image, None, fx=1.5, fy=1.5, interpolation=cv2.INTER_CUBIC)
-    image = resize_safe(image, max_dim=1400)
+def _resize_to_target(image, params):
+    h, w = image.shape[:2]
+    scale = target_scale(h, w, params["max_dim"], params["upscale"])
+    if scale == 1.0:
+        return image
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+def _to_gray(image):
+    if len(image.shape) == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    thresh = cv2.adaptiveThreshold(
-        gray,
-        255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY,
-        31,
-        2
-    )
 
-    kernel = np.ones((2, 2), np.uint8)
-    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+class TiledImage:
+    # A page cleaned up at its own resolution for tiled OCR. scale maps its
+    # pixel coordinates onto the ones run_pipeline would have produced, which
+    # is what the parser's spacing heuristics are tuned for.
+    def __init__(self, image, scale):
+        self.image = image
+        self.scale = scale
 
-    return thresh
+    @property
+    def shape(self):
+        return self.image.shape
+
+
+def run_pipeline(image, profile=DEFAULT_PROFILE, native=False):
+    p = get_profile(profile)
+
+    # Convert before resizing so the resample only touches one channel.
+    gray = _to_gray(image)
+    if not native:
+        gray = _resize_to_target(gray, p)
 
-def preprocess_image_from_array(image):
-    image = resize_safe(image, max_dim=1400)
-    image = cv2.resize(image, None, fx=1.5, fy=1.5, interpolation=cv2.INTER_CUBIC)
-    image = resize_safe(image, max_dim=1400)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    if p["blur_ksize"]:
+        gray = cv2.GaussianBlur(gray, (p["blur_ksize"], p["blur_ksize"]), 0)
 
     thresh = cv2.adaptiveThreshold(
         gray,
         255,
         cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         cv2.THRESH_BINARY,
-        31,
-        2
+        p["block_size"],
+        p["c"]
     )
 
-    kernel = np.ones((2, 2), np.uint8)
-    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+    if p["close_kernel"]:
+        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, _get_kernel(p["close_kernel"]))
 
     return thresh
+
+
+def run_tiled_pipeline(image, profile=DEFAULT_PROFILE):
+    # Images the profile would shrink keep their native resolution and are
+    # OCR'd tile by tile; the rest go through the usual pipeline.
+    p = get_profile(profile)
+    h, w = image.shape[:2]
+    scale = target_scale(h, w, p["max_dim"], p["upscale"])
+    if scale >= 1.0:
+        return run_pipeline(image, profile)
+    return TiledImage(run_pipeline(image, profile, native=True), scale)
+
+
+def _read_header(source):
+    # Height, width and format from the file header; no pixels are decoded.
+    try:
+        from PIL import Image
+        with Image.open(source) as image:
+            return image.height, image.width, image.format
+    except Exception:
+        return None
+
+
+def _decode_flags(header, profile, native=False):
+    # run_pipeline converts to grayscale first thing, so the color frame is
+    # never needed. A JPEG that will be shrunk is decoded at the largest
+    # reduction that still leaves at least the pixels run_pipeline resizes
+    # to; the remaining resize happens there as before.
+    if native or header is None or header[2] != "JPEG":
+        return cv2.IMREAD_GRAYSCALE
+    p = get_profile(profile)
+    scale = target_scale(header[0], header[1], p["max_dim"], p["upscale"])
+    for factor, flags in _REDUCED_GRAYSCALE:
+        if factor * scale <= 1.0:
+            return flags
+    return cv2.IMREAD_GRAYSCALE
+
+
+def decode_image(image_path, profile=DEFAULT_PROFILE, native=False):
+    flags = _decode_flags(_read_header(image_path), profile, native)
+    if os.path.getsize(image_path) >= MMAP_MIN_BYTES:
+        return cv2.imdecode(np.memmap(image_path, dtype=np.uint8, mode="r"), flags)
+    return cv2.imread(image_path, flags)
+
+
+def decode_image_bytes(data, profile=DEFAULT_PROFILE, native=False):
+    flags = _decode_flags(_read_header(io.BytesIO(data)), profile, native)
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def preprocess_image(image_path, profile=DEFAULT_PROFILE, tiled=False):
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"Image not found: {image_path}")
+
+    # Tiled OCR keeps native resolution, so it never takes a reduced decode.
+    image = decode_image(image_path, profile, native=tiled)
+    if image is None:
+        raise ValueError("Could not read image")
+
+    if tiled:
+        return run_tiled_pipeline(image, profile)
+    return run_pipeline(image, profile)
+
+def preprocess_image_from_array(image, profile=DEFAULT_PROFILE, tiled=False):
+    if tiled:
+        return run_tiled_pipeline(image, profile)
+    return run_pipeline(image, profile)
+
+def preprocess_text_layer(page, dpi, profile=DEFAULT_PROFILE):
+    # A text-layer page needs no pixels, only its word boxes mapped into the
+    # coordinates run_pipeline would have produced for the rasterized page,
+    # so the parser's pixel gaps behave the same as on OCR'd pages.
+    p = get_profile(profile)
+    px_scale = dpi / 72.0
+    scale = target_scale(page.height * px_scale, page.width * px_scale, p["max_dim"], p["upscale"])
+    return page.to_ocr_results(px_scale * scale)
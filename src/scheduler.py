@@ -0,0 +1,115 @@
+import os
+import signal
+import threading
+from contextlib import contextmanager
+from manifest import write_json_atomic
+
+RETRY_LIST_NAME = "retry.json"
+# Rough working-set model: the decoded frame (BGR for PDF pages; images
+# decode to grayscale, so this overestimates them) plus grayscale/threshold
+# copies of it, and a fixed allowance for EasyOCR's activations on a page
+# capped at the profile's max_dim.
+BYTES_PER_PIXEL = 5
+OCR_WORKING_BYTES = 384 * 1024 * 1024
+# PDFs whose page count or page size cannot be read are costed as this many
+# US Letter pages.
+DEFAULT_PDF_PAGES = 1
+LETTER_INCHES = (8.5, 11.0)
+
+
+class DocumentTimeout(BaseException):
+    # Not an Exception subclass, so the broad "except Exception" fallbacks in
+    # the OCR and parsing code cannot swallow it.
+    pass
+
+
+def estimate(file_path, dpi, batch_size):
+    # Cost from headers only: image dimensions without decoding and PDF page
+    # counts without rasterizing.
+    size = os.path.getsize(file_path)
+    if file_path.lower().endswith(".pdf"):
+        try:
+            from pdf_utils import pdf_page_count
+            pages = pdf_page_count(file_path) or DEFAULT_PDF_PAGES
+        except Exception:
+            pages = DEFAULT_PDF_PAGES
+        page_pixels = int(LETTER_INCHES[0] * dpi) * int(LETTER_INCHES[1] * dpi)
+        # Pages are rasterized one at a time but OCR'd batch_size at a time.
+        peak_pixels = page_pixels * min(pages, batch_size)
+    else:
+        try:
+            from PIL import Image
+            with Image.open(file_path) as image:
+                width, height = image.size
+            pages, page_pixels = 1, width * height
+        except Exception:
+            # Unreadable header: assume roughly one byte per pixel.
+            pages, page_pixels = 1, size
+        peak_pixels = page_pixels
+
+    return {
+        "path": file_path,
+        "pages": pages,
+        "pixels": pages * page_pixels,
+        "size": size,
+        "memory": peak_pixels * BYTES_PER_PIXEL + OCR_WORKING_BYTES,
+    }
+
+
+def plan(files, dpi, batch_size, memory_budget=None):
+    # Largest first: the long documents start early and the small ones fill
+    # in around them, so a pool does not end on one straggler. Documents that
+    # could never fit in the memory budget are returned separately.
+    estimates = [estimate(f, dpi, batch_size) for f in files]
+    estimates.sort(key=lambda e: (e["pixels"], e["size"]), reverse=True)
+    if not memory_budget:
+        return estimates, []
+    fits = [e for e in estimates if e["memory"] <= memory_budget]
+    too_large = [e for e in estimates if e["memory"] > memory_budget]
+    return fits, too_large
+
+
+def _can_alarm():
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def time_limit(seconds):
+    # SIGALRM-based, so it only works on POSIX in the main thread (which is
+    # where sequential runs and pool workers execute documents). Elsewhere
+    # documents run without a limit.
+    if not seconds or not _can_alarm():
+        yield
+        return
+
+    def _expired(signum, frame):
+        raise DocumentTimeout(f"exceeded {seconds}s time limit")
+
+    previous = signal.signal(signal.SIGALRM, _expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class RetryList:
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+
+    def add(self, file_path, reason, detail=""):
+        self.entries.append({"path": file_path, "reason": reason, "detail": str(detail)})
+
+    def save(self):
+        # The list describes the latest run only; a run with nothing to
+        # retry removes the one an earlier run left behind.
+        if not self.entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+                print(f"Removed retry list {self.path} (nothing to retry)")
+            return
+        write_json_atomic(self.path, {"files": self.entries}, indent=2)
+        print(f"Saved retry list {self.path} ({len(self.entries)} file(s))")
+
@@ -0,0 +1,402 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from preprocess import (
+    preprocess_image_from_array, preprocess_text_layer, decode_image_bytes, get_profile, PROFILES, DEFAULT_PROFILE
+)
+from ocr import extract_text_with_boxes_batch, results_to_text, _get_reader, configure_cpu
+from parser import parse_text
+from pdf_utils import iter_pdf_pages, pdf_text_layer, ocr_page_count, TextLayerPage, DEFAULT_DPI
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_MAX_BATCH = 8
+DEFAULT_MAX_WAIT_MS = 25
+DEFAULT_QUEUE_SIZE = 64
+# Requests admitted at once, from reading the body to the response. Bodies
+# and decoded pages of requests still waiting to reach the OCR queue are
+# held in memory, so they are bounded too.
+DEFAULT_MAX_REQUESTS = 16
+MAX_BODY_BYTES = 50 * 1024 * 1024
+LATENCY_WINDOW = 1000
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ExtractionService:
+    def __init__(self, profile=DEFAULT_PROFILE, dpi=DEFAULT_DPI, max_batch=DEFAULT_MAX_BATCH,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_requests=DEFAULT_MAX_REQUESTS):
+        self.profile = profile
+        self.dpi = dpi
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self.queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.max_requests = max(1, max_requests)
+        self.active_requests = 0
+        # A single OCR thread owns the reader; decode, preprocessing and
+        # parsing run on a separate pool so they overlap with inference.
+        self.ocr_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr")
+        self.cpu_executor = ThreadPoolExecutor(thread_name_prefix="cpu")
+        self.reader_ready = False
+        self.started_at = time.time()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {
+            "requests_total": 0,
+            "requests_failed": 0,
+            "requests_rejected": 0,
+            "pages_total": 0,
+            "batches_total": 0,
+        }
+        self._batch_task = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.ocr_executor, _get_reader)
+        self.reader_ready = True
+        self._batch_task = asyncio.create_task(self._batch_loop())
+
+    async def stop(self):
+        if self._batch_task:
+            self._batch_task.cancel()
+        self.ocr_executor.shutdown(wait=False)
+        self.cpu_executor.shutdown(wait=False)
+
+    def admit(self):
+        # Called before a request body is read.
+        if self.active_requests >= self.max_requests:
+            raise HTTPError(429, "Too many requests in progress")
+        self.active_requests += 1
+
+    def release(self):
+        self.active_requests -= 1
+
+    def _check_ocr_pages(self, count):
+        # A document that could never fit, even into an empty queue, must
+        # not be told to retry later.
+        if count > self.queue.maxsize:
+            raise HTTPError(413, f"Document has {count} pages to OCR; the queue holds at most {self.queue.maxsize}")
+        if self.queue.qsize() + count > self.queue.maxsize:
+            raise HTTPError(429, "OCR queue is full")
+
+    def _decode_pages(self, body, is_pdf):
+        if is_pdf:
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+                f.write(body)
+                pdf_path = f.name
+            try:
+                # The pages that need OCR are counted from the text layer and
+                # the page count, before anything is rasterized.
+                layer = pdf_text_layer(pdf_path)
+                try:
+                    count = ocr_page_count(pdf_path, layer)
+                except Exception:
+                    raise HTTPError(400, "Could not read PDF")
+                self._check_ocr_pages(count)
+                # Pages with a usable text layer come back as finished
+                # (bbox, text, conf) lists and never enter the OCR queue.
+                return [
+                    preprocess_text_layer(page, self.dpi, profile=self.profile)
+                    if isinstance(page, TextLayerPage)
+                    else preprocess_image_from_array(page, profile=self.profile)
+                    for page in iter_pdf_pages(pdf_path, dpi=self.dpi, layer=layer)
+                ]
+            finally:
+                os.remove(pdf_path)
+
+        image = decode_image_bytes(body, profile=self.profile)
+        if image is None:
+            raise HTTPError(400, "Could not decode image")
+        return [preprocess_image_from_array(image, profile=self.profile)]
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        preprocess_params = get_profile(self.profile)
+        while True:
+            batch = [await self.queue.get()]
+
+            # Coalesce whatever else arrives within the latency budget.
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            images = [image for image, _ in batch]
+            try:
+                outputs = await loop.run_in_executor(
+                    self.ocr_executor,
+                    lambda: extract_text_with_boxes_batch(
+                        images, batch_size=len(images), preprocess_params=preprocess_params
+                    ),
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.counters["batches_total"] += 1
+            self.counters["pages_total"] += len(batch)
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+    async def extract(self, body, is_pdf):
+        if self.queue.full():
+            raise HTTPError(429, "OCR queue is full")
+
+        loop = asyncio.get_running_loop()
+        pages = await loop.run_in_executor(self.cpu_executor, self._decode_pages, body, is_pdf)
+        images = [page for page in pages if not isinstance(page, list)]
+        # The queue may have filled up while this document was decoded.
+        self._check_ocr_pages(len(images))
+
+        futures = []
+        for page in pages:
+            future = loop.create_future()
+            if isinstance(page, list):
+                future.set_result((results_to_text(page), page))
+            else:
+                self.queue.put_nowait((page, future))
+            futures.append(future)
+        page_outputs = await asyncio.gather(*futures)
+
+        if is_pdf:
+            full_text = "".join(text + "\n" for text, _ in page_outputs)
+        else:
+            full_text = page_outputs[0][0] if page_outputs else ""
+        all_results = [r for _, results in page_outputs for r in results]
+        return await loop.run_in_executor(
+            self.cpu_executor, lambda: parse_text(full_text, ocr_results=all_results)
+        )
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+
+        def _pct(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))], 4)
+
+        batches = self.counters["batches_total"]
+        return dict(
+            self.counters,
+            queue_depth=self.queue.qsize(),
+            queue_capacity=self.queue.maxsize,
+            requests_active=self.active_requests,
+            mean_batch_size=round(self.counters["pages_total"] / batches, 2) if batches else None,
+            latency_p50_s=_pct(50),
+            latency_p95_s=_pct(95),
+            uptime_s=round(time.time() - self.started_at, 1),
+        )
+
+
+async def _read_request(reader, admit=None):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    body = b""
+    if method == "POST":
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            raise HTTPError(411, "Chunked bodies are not supported; send Content-Length")
+        if "content-length" not in headers:
+            raise HTTPError(411, "Content-Length required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HTTPError(400, "Malformed Content-Length")
+        if length < 0:
+            raise HTTPError(400, "Malformed Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        if admit is not None:
+            admit()
+        body = await reader.readexactly(length)
+
+    return method, target, version, headers, body
+
+
+def _write_response(writer, status, payload, keep_alive):
+    data = json.dumps(payload).encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(data)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + data)
+
+
+def _is_pdf_request(headers, query, body):
+    filename = query.get("filename", [""])[0].lower()
+    content_type = headers.get("content-type", "").lower()
+    return filename.endswith(".pdf") or "pdf" in content_type or body[:5] == b"%PDF-"
+
+
+async def _dispatch(service, method, target, headers, body):
+    url = urlsplit(target)
+    if url.path == "/health":
+        if method != "GET":
+            raise HTTPError(405, "Use GET")
+        return 200, {"status": "ok" if service.reader_ready else "starting"}
+
+    if url.path == "/metrics":
+        if method != "GET":
+            raise HTTPError(405, "Use GET")
+        return 200, service.metrics()
+
+    if url.path == "/extract":
+        if method != "POST":
+            raise HTTPError(405, "Use POST")
+        if not body:
+            raise HTTPError(400, "Empty request body")
+        service.counters["requests_total"] += 1
+        started = time.perf_counter()
+        result = await service.extract(body, _is_pdf_request(headers, parse_qs(url.query), body))
+        service.latencies.append(time.perf_counter() - started)
+        return 200, result
+
+    raise HTTPError(404, f"No route for {url.path}")
+
+
+async def _handle_connection(service, reader, writer):
+    try:
+        while True:
+            # A request rejected before its body was read leaves the body on
+            # the connection, so keep_alive stays False and it is closed.
+            keep_alive = False
+            admitted = False
+
+            def admit():
+                nonlocal admitted
+                service.admit()
+                admitted = True
+
+            try:
+                request = await _read_request(reader, admit)
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+                keep_alive = (
+                    headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                )
+                status, payload = await _dispatch(service, method, target, headers, body)
+            except HTTPError as e:
+                if e.status == 429:
+                    service.counters["requests_rejected"] += 1
+                status, payload = e.status, {"error": str(e)}
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception as e:
+                service.counters["requests_failed"] += 1
+                status, payload = 500, {"error": str(e)}
+            finally:
+                if admitted:
+                    service.release()
+
+            _write_response(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **service_options):
+    service = ExtractionService(**service_options)
+    print("Loading OCR models...")
+    await service.start()
+
+    server = await asyncio.start_server(
+        lambda r, w: _handle_connection(service, r, w), host, port
+    )
+    print(f"Listening on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Receipt extraction HTTP service")
+    arg_parser.add_argument("--host", default=DEFAULT_HOST)
+    arg_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    arg_parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE)
+    arg_parser.add_argument("--dpi", type=int, default=DEFAULT_DPI)
+    arg_parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                            help=f"max pages per OCR batch (default: {DEFAULT_MAX_BATCH})")
+    arg_parser.add_argument("--max-wait-ms", type=int, default=DEFAULT_MAX_WAIT_MS,
+                            help=f"how long to wait for a batch to fill (default: {DEFAULT_MAX_WAIT_MS})")
+    arg_parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                            help=f"pages that may wait for OCR before requests get 429 (default: {DEFAULT_QUEUE_SIZE})")
+    arg_parser.add_argument("--max-requests", type=int, default=DEFAULT_MAX_REQUESTS,
+                            help=f"requests handled at once before new ones get 429 (default: {DEFAULT_MAX_REQUESTS})")
+    arg_parser.add_argument("--threads", type=int,
+                            help="torch intra-op threads for OCR (default: one per core)")
+    arg_parser.add_argument("--interop-threads", type=int,
+                            help="torch inter-op threads for OCR (default: torch's choice)")
+    arg_parser.add_argument("--no-quantize", action="store_true",
+                            help="run EasyOCR's networks in float32 instead of dynamic int8")
+    args = arg_parser.parse_args(argv)
+
+    configure_cpu(threads=args.threads, interop_threads=args.interop_threads, quantize=not args.no_quantize)
+
+    try:
+        asyncio.run(serve(
+            host=args.host,
+            port=args.port,
+            profile=args.profile,
+            dpi=args.dpi,
+            max_batch=args.max_batch,
+            max_wait_ms=args.max_wait_ms,
+            queue_size=args.queue_size,
+            max_requests=args.max_requests,
+        ))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
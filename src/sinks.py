@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import sqlite3
+
+SINKS = ("json", "jsonl", "sqlite")
+DEFAULT_SINK = "json"
+DEFAULT_FLUSH_EVERY = 100
+DEFAULT_FILENAMES = {"jsonl": "results.jsonl", "sqlite": "results.sqlite"}
+
+
+class JsonSink:
+    # One indented JSON file per document, the original output format.
+    kind = "json"
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, source, parsed):
+        output_name = os.path.splitext(os.path.basename(source))[0]
+        output_path = os.path.join(self.output_dir, f"{output_name}.json")
+        with open(output_path, "w") as f:
+            json.dump(parsed, f, indent=4)
+        print(f"Saved {output_path}")
+        return output_path
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    # One compact record per document appended to a single file. Records
+    # are buffered and written in blocks, so a large run does a handful of
+    # sequential writes instead of one file per document.
+    kind = "jsonl"
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self._pending = []
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write(self, source, parsed):
+        self._pending.append(json.dumps(dict(parsed, source=source), ensure_ascii=False))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+        print(f"Saved {source} -> {self.path}")
+        return self.path
+
+    def flush(self):
+        if not self._pending:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._pending) + "\n")
+        self._pending = []
+
+    def close(self):
+        self.flush()
+
+
+class SQLiteSink:
+    # documents holds one row per source (re-processing replaces it) and
+    # line_items one row per extracted item. Rows are committed in batches,
+    # so the cost of a transaction is spread over many documents.
+    kind = "sqlite"
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self._pending = []
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Results may be written from a pipeline thread; only one thread
+        # uses the connection at a time.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL UNIQUE,
+                merchant_name TEXT,
+                invoice_number TEXT,
+                date TEXT,
+                total_amount REAL,
+                currency TEXT,
+                processed_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS line_items (
+                document_id INTEGER NOT NULL REFERENCES documents(id),
+                position INTEGER NOT NULL,
+                item TEXT,
+                quantity REAL,
+                price REAL,
+                unit_price REAL
+            );
+            CREATE INDEX IF NOT EXISTS line_items_document ON line_items(document_id);
+        """)
+
+    def write(self, source, parsed):
+        self._pending.append((source, parsed, time.time()))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+        print(f"Saved {source} -> {self.path}")
+        return self.path
+
+    def flush(self):
+        if not self._pending:
+            return
+        # A source written twice in one batch keeps only its latest result.
+        latest = {}
+        for entry in self._pending:
+            latest[entry[0]] = entry
+        pending = list(latest.values())
+        sources = [(source,) for source, _, _ in pending]
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM line_items WHERE document_id IN (SELECT id FROM documents WHERE source = ?)",
+                sources,
+            )
+            self.conn.executemany("DELETE FROM documents WHERE source = ?", sources)
+
+            item_rows = []
+            for source, parsed, processed_at in pending:
+                cursor = self.conn.execute(
+                    "INSERT INTO documents (source, merchant_name, invoice_number, date, total_amount,"
+                    " currency, processed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (source, parsed.get("merchant_name"), parsed.get("invoice_number"), parsed.get("date"),
+                     parsed.get("total_amount"), parsed.get("currency"), processed_at),
+                )
+                for position, item in enumerate(parsed.get("line_items") or []):
+                    item_rows.append((cursor.lastrowid, position, item.get("item"), item.get("quantity"),
+                                      item.get("price"), item.get("unit_price")))
+            self.conn.executemany(
+                "INSERT INTO line_items (document_id, position, item, quantity, price, unit_price)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                item_rows,
+            )
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def open_sink(kind=DEFAULT_SINK, output_dir="output", path=None):
+    if kind == "json":
+        return JsonSink(path or output_dir)
+    path = path or os.path.join(output_dir, DEFAULT_FILENAMES.get(kind, ""))
+    if kind == "jsonl":
+        return JsonLinesSink(path)
+    if kind == "sqlite":
+        return SQLiteSink(path)
+    raise ValueError(f"Unknown output sink: {kind}")
@@ -0,0 +1,114 @@
+import os
+import re
+import json
+from manifest import write_json_atomic
+
+INDEX_NAME = ".vendor_layouts.json"
+# How far (as a fraction of the text block height) the header of a known
+# vendor may drift from its learned position and still be looked for there.
+HEADER_Y_TOLERANCE = 0.1
+# A layout is only applied without a header once the same merchant has shown
+# it this many times; a single sighting may be a different store that
+# happens to share the name.
+MIN_SEEN = 2
+# Learned columns further apart than this (as a fraction of the text block
+# width) are a different layout, which restarts the count.
+COLUMN_TOLERANCE = 0.05
+# Document titles that the merchant detection can pick up from stores that
+# print no name of their own; they say nothing about the layout.
+GENERIC_TITLES = {
+    "receipt", "cash receipt", "sales receipt", "payment receipt", "invoice", "tax invoice",
+    "bill", "cash bill", "bill of supply", "estimate", "quotation",
+}
+
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+_PATH = None
+_LAYOUTS = {}
+_UPDATES = {}
+
+
+def configure(path=None):
+    # With no path the index is disabled and the parser behaves exactly as
+    # it does without one.
+    global _PATH, _LAYOUTS, _UPDATES
+    _PATH = path
+    _LAYOUTS = {}
+    _UPDATES = {}
+    if path and os.path.exists(path):
+        try:
+            with open(path) as f:
+                _LAYOUTS = json.load(f).get("vendors", {})
+        except Exception as e:
+            print(f"Ignoring unreadable vendor index {path}: {e}")
+
+
+def get_path():
+    return _PATH
+
+
+def is_enabled():
+    return _PATH is not None
+
+
+def vendor_key(merchant_name):
+    if not merchant_name:
+        return None
+    key = _NON_ALNUM_RE.sub(" ", merchant_name.lower()).strip()
+    if not key or key in GENERIC_TITLES:
+        return None
+    return key
+
+
+def lookup(merchant_name):
+    if _PATH is None:
+        return None
+    key = vendor_key(merchant_name)
+    entry = _LAYOUTS.get(key) if key else None
+    if entry is None or entry["seen"] < MIN_SEEN:
+        return None
+    return entry
+
+
+def _same_layout(a, b):
+    return set(a) == set(b) and all(abs(a[k] - b[k]) <= COLUMN_TOLERANCE for k in a)
+
+
+def learn(merchant_name, columns, header_y):
+    # columns maps item/qty/price/total to x positions normalized to the
+    # text block width; header_y is the header row's normalized y.
+    key = vendor_key(merchant_name)
+    if _PATH is None or not key or not columns:
+        return
+    entry = _LAYOUTS.get(key)
+    seen = entry["seen"] + 1 if entry and _same_layout(entry["columns"], columns) else 1
+    entry = {
+        "columns": {k: round(v, 4) for k, v in columns.items()},
+        "header_y": round(header_y, 4),
+        "seen": seen,
+    }
+    _LAYOUTS[key] = entry
+    _UPDATES[key] = entry
+
+
+def drain_updates():
+    # Worker processes learn layouts locally and hand them to the parent,
+    # which owns the index file.
+    global _UPDATES
+    updates = _UPDATES
+    _UPDATES = {}
+    return updates
+
+
+def merge(updates):
+    for key, entry in (updates or {}).items():
+        current = _LAYOUTS.get(key)
+        if current is not None and _same_layout(current["columns"], entry["columns"]):
+            entry = dict(entry, seen=max(entry["seen"], current["seen"] + 1))
+        _LAYOUTS[key] = entry
+
+
+def save():
+    if _PATH is None:
+        return
+    write_json_atomic(_PATH, {"vendors": _LAYOUTS}, indent=2)
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+from manifest import write_json_atomic
+
+QUEUE_NAME = ".watch_queue.json"
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+DEFAULT_POLL_INTERVAL = 1.0
+# A file is picked up once its size and modification time have stayed the
+# same for this long, so a scanner that is still writing it is left alone.
+DEFAULT_SETTLE_SECONDS = 2.0
+# A file that was being processed when the daemon died counts as one
+# attempt; after this many it goes to failed/ instead of taking the daemon
+# down again.
+MAX_ATTEMPTS = 3
+
+
+class WorkQueue:
+    # Settled files waiting to be processed, in arrival order. Saved on every
+    # change, so a restarted daemon carries on where the last one stopped.
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f).get("files", [])
+            except Exception as e:
+                print(f"Ignoring unreadable work queue {path}: {e}")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, file_path):
+        return any(entry["path"] == file_path for entry in self.entries)
+
+    def add(self, file_path):
+        self.entries.append({"path": file_path, "queued_at": time.time(), "attempts": 0})
+        self.save()
+
+    def remove(self, file_path):
+        self.entries = [entry for entry in self.entries if entry["path"] != file_path]
+        self.save()
+
+    def save(self):
+        write_json_atomic(self.path, {"files": self.entries}, indent=2)
+
+
+def _scan(input_dir, extensions, seen, settle_seconds):
+    # seen maps each candidate to its last (size, mtime) and when that was
+    # first observed; a file is ready once it has not changed for
+    # settle_seconds. Empty files are still being created.
+    now = time.monotonic()
+    current = {}
+    ready = []
+    for name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, name)
+        if not name.lower().endswith(extensions):
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if not os.path.isfile(path):
+            continue
+        key = (stat.st_size, stat.st_mtime_ns)
+        previous = seen.get(path)
+        since = previous[1] if previous is not None and previous[0] == key else now
+        current[path] = (key, since)
+        if stat.st_size and now - since >= settle_seconds:
+            ready.append(path)
+    seen.clear()
+    seen.update(current)
+    return ready
+
+
+def move_to(file_path, subdir):
+    target_dir = os.path.join(os.path.dirname(file_path), subdir)
+    os.makedirs(target_dir, exist_ok=True)
+    name = os.path.basename(file_path)
+    stem, ext = os.path.splitext(name)
+    target = os.path.join(target_dir, name)
+    n = 1
+    while os.path.exists(target):
+        target = os.path.join(target_dir, f"{stem}.{n}{ext}")
+        n += 1
+    shutil.move(file_path, target)
+    return target
+
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+
+def watch(input_dir, process, extensions, queue_path, poll_interval=DEFAULT_POLL_INTERVAL,
+          settle_seconds=DEFAULT_SETTLE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    # Runs until interrupted. process(file_path) returns True when the file
+    # was handled and False when it failed; the file is then moved to done/
+    # or failed/ inside input_dir. The folder is re-scanned between files,
+    # so new arrivals start settling while a long document is processed.
+    work = WorkQueue(queue_path)
+    seen = {}
+    # SIGTERM unwinds like Ctrl+C, so the caller's cleanup still runs.
+    signal.signal(signal.SIGTERM, _stop)
+    print(f"Watching {input_dir} ({len(work)} file(s) queued, Ctrl+C to stop)")
+
+    while True:
+        for path in _scan(input_dir, extensions, seen, settle_seconds):
+            if path not in work:
+                work.add(path)
+
+        if not len(work):
+            time.sleep(poll_interval)
+            continue
+
+        entry = work.entries[0]
+        path = entry["path"]
+        if not os.path.exists(path):
+            work.remove(path)
+            continue
+        if entry["attempts"] >= max_attempts:
+            print(f"Giving up on {path} after {entry['attempts']} attempt(s)")
+            move_to(path, FAILED_DIR)
+            work.remove(path)
+            continue
+
+        entry["attempts"] += 1
+        work.save()
+        try:
+            ok = process(path)
+        except (KeyboardInterrupt, SystemExit):
+            # Being stopped is not the file's fault.
+            entry["attempts"] -= 1
+            work.save()
+            raise
+        moved = move_to(path, DONE_DIR if ok else FAILED_DIR)
+        work.remove(path)
+        print(f"Moved {path} -> {moved}")